@@ -0,0 +1,114 @@
+"""
+Benchmarks the inverted index of DBQuery against the former linear scan of the database.
+
+Run from the repository root:
+    python -m benchmarks.db_query_benchmark
+"""
+
+import argparse
+import pickle
+import random
+import timeit
+
+import dialogue_system.dialogue_config as cfg
+import dialogue_system.constants as const
+from dialogue_system.dm.dst.kb_index import KBIndex
+from utils.util import remove_empty_slots
+
+
+def linear_scan(database, constraints):
+    """The linear scan that DBQuery.get_db_results used before the inverted index."""
+
+    available_options = {}
+    for id in database.keys():
+        current_option_dict = database[id]
+        if len(set(constraints.keys()) - set(database[id].keys())) == 0:
+            match = True
+            for k, v in constraints.items():
+                if str(v).lower() != str(current_option_dict[k]).lower():
+                    match = False
+            if match:
+                available_options.update({id: current_option_dict})
+    return available_options
+
+
+def index_query(index, constraints):
+    """The query done by DBQuery.get_db_results on a cache miss."""
+
+    return {id: index.database[id] for id in index.match(index.value_codes(constraints))}
+
+
+def scale_database(database, factor):
+    """
+    Returns a synthetic database `factor` times larger than the given one.
+
+    Each copy keeps the slot structure of the original items, but the theater and city values are suffixed with the
+    copy number, so the selectivity of the queries stays close to the original one.
+    """
+
+    scaled = {}
+    new_id = 0
+    for copy_number in range(factor):
+        for item in database.values():
+            new_item = dict(item)
+            if copy_number > 0:
+                for slot in ('theater', 'city'):
+                    if slot in new_item:
+                        new_item[slot] = f'{new_item[slot]} {copy_number}'
+            scaled[new_id] = new_item
+            new_id += 1
+    return scaled
+
+
+def build_queries(database, goals, num_queries):
+    """Builds constraint sets the way the state tracker does, as growing prefixes of the user goal informs."""
+
+    queries = []
+    items = list(database.values())
+    while len(queries) < num_queries:
+        if random.random() < 0.5:
+            informs = random.choice(goals)[const.INFORM_SLOTS]
+        else:
+            informs = random.choice(items)
+        constraints = [(k, v) for k, v in informs.items() if k not in cfg.no_query_keys]
+        random.shuffle(constraints)
+        for size in range(len(constraints) + 1):
+            queries.append(dict(constraints[:size]))
+    return queries[:num_queries]
+
+
+def run(database, goals, num_queries, name):
+    queries = build_queries(database, goals, num_queries)
+
+    build_time = timeit.timeit(lambda: KBIndex(database), number=1)
+    index = KBIndex(database)
+
+    for constraints in queries:
+        assert list(index_query(index, constraints).items()) == list(linear_scan(database, constraints).items())
+
+    scan_time = timeit.timeit(lambda: [linear_scan(database, c) for c in queries], number=1)
+    index_time = timeit.timeit(lambda: [index_query(index, c) for c in queries], number=1)
+
+    print(f'{name}: {len(database)} items, {len(queries)} queries')
+    print(f'  index build:  {build_time * 1e3:10.2f} ms')
+    print(f'  linear scan:  {scan_time / len(queries) * 1e6:10.2f} us/query')
+    print(f'  index:        {index_time / len(queries) * 1e6:10.2f} us/query')
+    print(f'  speedup:      {scan_time / index_time:10.1f}x')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', dest='database', type=str, default='data/movie_db.p')
+    parser.add_argument('--user_goals', dest='user_goals', type=str, default='data/movie_user_goals.p')
+    parser.add_argument('--num_queries', dest='num_queries', type=int, default=2000)
+    parser.add_argument('--scale', dest='scale', type=int, default=100)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    database = pickle.load(open(args.database, 'rb'), encoding='latin1')
+    remove_empty_slots(database)
+    goals = pickle.load(open(args.user_goals, 'rb'), encoding='latin1')
+
+    run(database, goals, args.num_queries, args.database)
+    run(scale_database(database, args.scale), goals, args.num_queries // 10, f'{args.database} x{args.scale}')
@@ -0,0 +1,146 @@
+"""
+Benchmarks prioritized experience replay against uniform replay.
+
+Measures the cost of sampling a batch from the sum tree, then trains the agent of a config with uniform and with
+prioritized replay, the way the Trainer does, and reports the wall-clock time and the number of episodes each needed
+to reach a success rate.
+
+Run from the repository root:
+    python -m benchmarks.prioritized_replay_benchmark --config_file config_softmax.json
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import time
+import timeit
+
+import numpy as np
+
+import dialogue_system.dialogue_config as cfg
+from dialogue_system import DialogueSystem
+from dialogue_system.dm.agents.replay_memory import ReplayBuffer, PrioritizedReplay
+from dialogue_system.dm.dst.state_encoder import StateEncoder
+from utils.util import convert_list_to_dict
+
+
+def fill(memory, state_size, num_experiences):
+    """Fills a memory with random experiences."""
+
+    for _ in range(num_experiences):
+        memory.add(np.random.random(state_size).astype(np.float32), random.randrange(40), random.random(),
+                   np.random.random(state_size).astype(np.float32), random.random() < 0.1)
+
+
+def run_sampling(capacity, state_size, batch_size, num_batches):
+    uniform = ReplayBuffer(capacity)
+    prioritized = PrioritizedReplay(ReplayBuffer(capacity), alpha=0.6, epsilon=1e-6)
+    fill(uniform, state_size, capacity)
+    fill(prioritized, state_size, capacity)
+    td_errors = np.random.normal(size=batch_size)
+
+    def prioritized_batch():
+        indices = prioritized.sample_prioritized(batch_size, beta=0.4)[5]
+        prioritized.update_priorities(indices, td_errors)
+
+    uniform_time = timeit.timeit(lambda: uniform.sample(batch_size), number=num_batches)
+    prioritized_time = timeit.timeit(prioritized_batch, number=num_batches)
+
+    print(f'Sampling: {capacity} experiences (state size {state_size}), batches of {batch_size}')
+    print(f'  uniform:                 {uniform_time / num_batches * 1e6:10.2f} us/batch')
+    print(f'  prioritized (+ update):  {prioritized_time / num_batches * 1e6:10.2f} us/batch')
+
+
+def train_until(config, target_success_rate, max_episodes, seed):
+    """
+    Trains a new dialogue system until the success rate of a training period reaches the target.
+
+    Returns:
+        tuple: The wall-clock time in seconds and the number of episodes, None if the target was not reached
+    """
+
+    random.seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+
+    dialogue_system = DialogueSystem(config)
+    agent = dialogue_system.agent
+    run_dict = config['run']
+
+    # Warmup with the rule-based policy
+    total_step = 0
+    episode = 0
+    while total_step != run_dict['warmup_mem'] and not agent.is_memory_full():
+        dialogue_system.reset(episode)
+        done = False
+        while not done:
+            _, _, done, _ = dialogue_system.run_round(use_rule=True)
+            total_step += 1
+        episode += 1
+    agent.copy()
+    agent.train()
+
+    episode = 0
+    successes = 0
+    while episode < max_episodes:
+        dialogue_system.reset(episode)
+        done = False
+        while not done:
+            _, _, done, success = dialogue_system.run_round(step=total_step)
+            total_step += 1
+        successes += success
+
+        if episode % run_dict['train_freq'] == 0:
+            success_rate = successes / run_dict['train_freq']
+            successes = 0
+            if success_rate >= target_success_rate:
+                return time.perf_counter() - start, episode
+            agent.copy()
+            agent.train()
+        episode += 1
+
+    return None
+
+
+def run_training(config, target_success_rate, max_episodes, seed):
+    print(f'Training until a success rate of {target_success_rate}')
+    for enabled in (False, True):
+        run_config = copy.deepcopy(config)
+        run_config['agent']['prioritized_replay']['enabled'] = enabled
+        result = train_until(run_config, target_success_rate, max_episodes, seed)
+
+        name = 'prioritized' if enabled else 'uniform'
+        if result is None:
+            print(f'  {name + ":":13} not reached in {max_episodes} episodes')
+        else:
+            print(f'  {name + ":":13} {result[0]:10.1f} s, {result[1]} episodes')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_file', dest='config_file', type=str, default='config_softmax.json')
+    parser.add_argument('--success_rate', dest='success_rate', type=float, default=0.6)
+    parser.add_argument('--max_episodes', dest='max_episodes', type=int, default=5000)
+    parser.add_argument('--capacity', dest='capacity', type=int, default=50000)
+    parser.add_argument('--num_batches', dest='num_batches', type=int, default=2000)
+    parser.add_argument('--sampling_only', dest='sampling_only', action='store_true')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(os.path.join('config', args.config_file)) as f:
+        config = json.load(f)
+    # No weights are saved or loaded and the dialogues are not traced
+    config['agent']['save_weights_file_path'] = ''
+    config['agent']['load_weights_file_path'] = ''
+    config['run']['dialogue_log'] = False
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    # The states have the size of the state representation the agent gets with this config
+    state_size = StateEncoder(convert_list_to_dict(cfg.all_intents), convert_list_to_dict(cfg.all_slots),
+                              config['run']['max_round_num']).state_size
+    run_sampling(args.capacity, state_size, config['agent']['batch_size'], args.num_batches)
+    if not args.sampling_only:
+        run_training(config, args.success_rate, args.max_episodes, args.seed)
@@ -0,0 +1,137 @@
+"""
+Benchmarks the preallocated StateEncoder against the former np.hstack encoding of StateTracker.get_state.
+
+Run from the repository root:
+    python -m benchmarks.state_encoder_benchmark
+"""
+
+import argparse
+import copy
+import random
+import timeit
+
+import numpy as np
+
+import dialogue_system.dialogue_config as cfg
+import dialogue_system.constants as const
+from dialogue_system.dm.dst.dialogue_history import DialogueHistory
+from dialogue_system.dm.dst.state_encoder import StateEncoder
+from utils.util import convert_list_to_dict
+
+
+def hstack_encode(intents_dict, slots_dict, max_round_num, user_action, last_agent_action, current_informs,
+                  round_num, db_results_dict):
+    """The encoding that StateTracker.get_state used before the state encoder."""
+
+    num_intents = len(intents_dict)
+    num_slots = len(slots_dict)
+
+    user_act_rep = np.zeros((num_intents,))
+    user_act_rep[intents_dict[user_action[const.INTENT]]] = 1.0
+
+    user_inform_slots_rep = np.zeros((num_slots,))
+    for key in user_action[const.INFORM_SLOTS].keys():
+        user_inform_slots_rep[slots_dict[key]] = 1.0
+
+    user_request_slots_rep = np.zeros((num_slots,))
+    for key in user_action[const.REQUEST_SLOTS].keys():
+        user_request_slots_rep[slots_dict[key]] = 1.0
+
+    current_slots_rep = np.zeros((num_slots,))
+    for key in current_informs:
+        current_slots_rep[slots_dict[key]] = 1.0
+
+    agent_act_rep = np.zeros((num_intents,))
+    if last_agent_action:
+        agent_act_rep[intents_dict[last_agent_action[const.INTENT]]] = 1.0
+
+    agent_inform_slots_rep = np.zeros((num_slots,))
+    if last_agent_action:
+        for key in last_agent_action[const.INFORM_SLOTS].keys():
+            agent_inform_slots_rep[slots_dict[key]] = 1.0
+
+    agent_request_slots_rep = np.zeros((num_slots,))
+    if last_agent_action:
+        for key in last_agent_action[const.REQUEST_SLOTS].keys():
+            agent_request_slots_rep[slots_dict[key]] = 1.0
+
+    turn_rep = np.zeros((1,)) + round_num / 5.
+
+    turn_onehot_rep = np.zeros((max_round_num,))
+    turn_onehot_rep[round_num - 1] = 1.0
+
+    kb_count_rep = np.zeros((num_slots + 1,)) + db_results_dict[const.KB_MATCHING_ALL_CONSTRAINTS] / 100.
+    for key in db_results_dict.keys():
+        if key in slots_dict:
+            kb_count_rep[slots_dict[key]] = db_results_dict[key] / 100.
+
+    kb_binary_rep = np.zeros((num_slots + 1,)) + np.sum(db_results_dict[const.KB_MATCHING_ALL_CONSTRAINTS] > 0.)
+    for key in db_results_dict.keys():
+        if key in slots_dict:
+            kb_binary_rep[slots_dict[key]] = np.sum(db_results_dict[key] > 0.)
+
+    return np.hstack([user_act_rep, user_inform_slots_rep, user_request_slots_rep, agent_act_rep,
+                      agent_inform_slots_rep, agent_request_slots_rep, current_slots_rep, turn_rep, turn_onehot_rep,
+                      kb_binary_rep, kb_count_rep]).flatten()
+
+
+def random_action(speaker_slots):
+    """Returns a random action with random inform and request slots."""
+
+    action = {const.INTENT: random.choice(cfg.all_intents),
+              const.INFORM_SLOTS: {slot: 'value' for slot in random.sample(speaker_slots, random.randint(0, 4))},
+              const.REQUEST_SLOTS: {slot: const.UNKNOWN for slot in random.sample(speaker_slots, random.randint(0, 2))}}
+    return action
+
+
+def build_turns(num_turns, max_round_num):
+    """Builds random turns, as the user and agent actions, current informs, round num and KB counts of the turn."""
+
+    turns = []
+    for _ in range(num_turns):
+        current_informs = {slot: 'value' for slot in random.sample(cfg.all_slots, random.randint(0, 8))}
+        db_results_dict = {key: random.randint(0, 300) for key in current_informs}
+        db_results_dict[const.KB_MATCHING_ALL_CONSTRAINTS] = random.randint(0, 50)
+        last_agent_action = random_action(cfg.all_slots) if random.random() < 0.9 else None
+        turns.append((random_action(cfg.all_slots), last_agent_action, current_informs,
+                      random.randint(1, max_round_num), db_results_dict))
+    return turns
+
+
+def build_history(intents_dict, slots_dict, user_action, last_agent_action):
+    """Returns the history of a turn, as kept by the state tracker."""
+
+    history = DialogueHistory(intents_dict, slots_dict)
+    if last_agent_action is not None:
+        history.append(last_agent_action)
+    history.append(user_action)
+    return history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_turns', dest='num_turns', type=int, default=20000)
+    parser.add_argument('--max_round_num', dest='max_round_num', type=int, default=20)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    intents_dict = convert_list_to_dict(cfg.all_intents)
+    slots_dict = convert_list_to_dict(cfg.all_slots)
+    encoder = StateEncoder(intents_dict, slots_dict, args.max_round_num)
+    turns = build_turns(args.num_turns, args.max_round_num)
+    encoder_turns = [(build_history(intents_dict, slots_dict, *turn[:2]),) + turn[2:] for turn in turns]
+
+    for turn, encoder_turn in zip(turns, encoder_turns):
+        expected = hstack_encode(intents_dict, slots_dict, args.max_round_num, *copy.deepcopy(turn))
+        assert np.allclose(encoder.encode(*encoder_turn), expected.astype(np.float32))
+
+    hstack_time = timeit.timeit(
+        lambda: [hstack_encode(intents_dict, slots_dict, args.max_round_num, *turn) for turn in turns], number=1)
+    copy_time = timeit.timeit(lambda: [encoder.encode(*turn) for turn in encoder_turns], number=1)
+    view_time = timeit.timeit(lambda: [encoder.encode(*turn, view=True) for turn in encoder_turns], number=1)
+
+    print(f'{len(turns)} turns, state size {encoder.state_size}')
+    print(f'  np.hstack:        {hstack_time / len(turns) * 1e6:8.2f} us/turn')
+    print(f'  encoder (copy):   {copy_time / len(turns) * 1e6:8.2f} us/turn  ({hstack_time / copy_time:.1f}x)')
+    print(f'  encoder (view):   {view_time / len(turns) * 1e6:8.2f} us/turn  ({hstack_time / view_time:.1f}x)')
@@ -12,7 +12,7 @@ import dialogue_system.nlu as nlus
 import dialogue_system.nlg as nlgs
 
 from dialogue_system.users.error_model_controller import ErrorModelController
-from utils.util import remove_empty_slots, log
+from utils.util import remove_empty_slots, log, is_logging_enabled, set_logging_enabled
 
 
 class DialogueSystem:
@@ -26,7 +26,12 @@ class DialogueSystem:
         self.nlg = nlgs.load(config)
         self.state_tracker = state_trackers.load(config)
         self.agent = agents.load(config)
-        self.agent.build_models(self.state_tracker.get_state_size())
+        self.agent.build_models(self.state_tracker.get_state_size(),
+                                self.state_tracker.state_encoder.dense_positions)
+
+        # The dialogue tracing can be turned off (e.g. for training runs), then its messages are not even built, nor
+        # copied to the debug log
+        set_logging_enabled('dialogue', config['run']['dialogue_log'])
 
         self.use_nl = config['use_nl']
         self.real_user = config['real_user']
@@ -38,26 +43,30 @@ class DialogueSystem:
 
         # 2) Update state tracker with the agent's action
         self.state_tracker.update_state_agent(agent_action)
-        log(['dialogue', 'debug'], f'Agent action: {agent_action}')
+        if is_logging_enabled(['dialogue']):
+            log(['dialogue', 'debug'], f'Agent action: {agent_action}')
         if self.use_nl:
             agent_action['nl'] = self.nlg.convert_diaact_to_nl(agent_action, 'agt')
         # agent_action = self.__transform_action(agent_action)
-        log(['dialogue'], f"Agent sentence: {agent_action.get('nl', None)}")
+        if is_logging_enabled(['dialogue']):
+            log(['dialogue'], f"Agent sentence: {agent_action.get('nl', None)}")
 
         # 3) User takes action given agent action
         user_action, reward, done, success = self.user.step(agent_action)
-        log(['dialogue'], f"User sentence: {user_action.get('nl', None)}")
+        if is_logging_enabled(['dialogue']):
+            log(['dialogue'], f"User sentence: {user_action.get('nl', None)}")
         if not done:
             # 4) Infuse error into semantic frame level of user action
             if self.use_nl and not self.real_user:
                 user_action['nl'] = self.nlg.convert_diaact_to_nl(user_action, 'usr')
         user_action = self.__transform_action(user_action)
-        aux = copy.deepcopy(user_action)
-        try:
-            aux.pop('nl')
-        except:
-            pass
-        log(['dialogue', 'debug'], f'User action: {aux}')
+        if is_logging_enabled(['dialogue']):
+            aux = copy.deepcopy(user_action)
+            try:
+                aux.pop('nl')
+            except:
+                pass
+            log(['dialogue', 'debug'], f'User action: {aux}')
 
         # 5) Update state tracker with user action
         self.state_tracker.update_state_user(user_action)
@@ -83,17 +92,19 @@ class DialogueSystem:
         self.state_tracker.reset()
         # Then pick an init user action
         user_action = self.user.reset(episode, train)
-        log(['dialogue'], f"User sentence: {user_action.get('nl', None)}")
+        if is_logging_enabled(['dialogue']):
+            log(['dialogue'], f"User sentence: {user_action.get('nl', None)}")
         if self.use_nl and not self.real_user:
             user_action['nl'] = self.nlg.convert_diaact_to_nl(user_action, 'usr')
         # if nl transform in frame, if frame use emc
         user_action = self.__transform_action(user_action)
-        aux = copy.deepcopy(user_action)
-        try:
-            aux.pop('nl')
-        except:
-            pass
-        log(['dialogue'], f'User action: {aux}')
+        if is_logging_enabled(['dialogue']):
+            aux = copy.deepcopy(user_action)
+            try:
+                aux.pop('nl')
+            except:
+                pass
+            log(['dialogue'], f'User action: {aux}')
         # And update state tracker
         self.state_tracker.update_state_user(user_action)
         self.state = self.state_tracker.get_state()
@@ -0,0 +1,78 @@
+from types import MappingProxyType
+import dialogue_system.constants as const
+
+
+def action_key(action):
+    """
+    Returns a hashable key of an action, equal for the actions that are equal as dicts.
+
+    Parameters:
+        action (dict): The action of format dict('intent': '', 'inform_slots': {}, 'request_slots': {})
+
+    Returns:
+        tuple: The intent and the frozensets of the inform and request slot items
+    """
+
+    return (action[const.INTENT], frozenset(action[const.INFORM_SLOTS].items()),
+            frozenset(action[const.REQUEST_SLOTS].items()))
+
+
+class ActionTable:
+    """The possible actions of the agent, mapped from index to template and from template to index in O(1)."""
+
+    def __init__(self, possible_actions):
+        """
+        The constructor for ActionTable.
+
+        Parameters:
+            possible_actions (list): The possible actions of format dict('intent': '', 'inform_slots': {},
+                                     'request_slots': {})
+        """
+
+        # The templates are read-only, the actions handed out are copies of them
+        self.templates = tuple(
+            MappingProxyType({const.INTENT: action[const.INTENT],
+                              const.INFORM_SLOTS: MappingProxyType(dict(action[const.INFORM_SLOTS])),
+                              const.REQUEST_SLOTS: MappingProxyType(dict(action[const.REQUEST_SLOTS]))})
+            for action in possible_actions)
+        self.indices = {}
+        for index, template in enumerate(self.templates):
+            self.indices.setdefault(action_key(template), index)
+
+    def index(self, action):
+        """
+        Returns the index of an action.
+
+        Parameters:
+            action (dict): The action of format dict('intent': '', 'inform_slots': {}, 'request_slots': {})
+
+        Returns:
+            int: The index of the action, None if it is not a possible action
+        """
+
+        try:
+            return self.indices.get(action_key(action))
+        except TypeError:
+            # An action with an unhashable slot value is none of the templates
+            return None
+
+    def action(self, index):
+        """
+        Returns a new action built from the template of an index.
+
+        The state tracker only replaces the inform slots dict or sets items of the action and of its inform slots, so
+        copying the two levels of dicts is enough to keep the templates untouched (the slot values are strings).
+
+        Parameters:
+            index (int): The index of the action
+
+        Returns:
+            dict: The action of format dict('intent': '', 'inform_slots': {}, 'request_slots': {})
+        """
+
+        template = self.templates[index]
+        return {const.INTENT: template[const.INTENT], const.INFORM_SLOTS: dict(template[const.INFORM_SLOTS]),
+                const.REQUEST_SLOTS: dict(template[const.REQUEST_SLOTS])}
+
+    def __len__(self):
+        return len(self.templates)
@@ -2,11 +2,16 @@ from keras.models import Sequential
 from keras.layers import Dense
 from keras.optimizers import Adam
 import dialogue_system.dm.agents.models as models
+from dialogue_system.dm.agents.models.numpy_inference import NumpyInference
+from dialogue_system.dm.agents.action_table import ActionTable
+from dialogue_system.dm.agents.replay_memory import (
+    ReplayMemory, ReplayBuffer, PackedReplayBuffer, AliasedReplayBuffer, PrioritizedReplay
+)
+from dialogue_system.dm.dst.state_encoder import stack_states
 import dialogue_system.constants as const
 import dialogue_system.dialogue_config as cfg
-import random
-import copy
 import numpy as np
+import threading
 import re
 import os
 
@@ -30,12 +35,23 @@ class DQNAgent:
 
         """
         self.C = config['agent']
-        self.memory = []
-        self.memory_index = 0
         self.max_memory_size = self.C['max_mem_size']
         self.vanilla = self.C['vanilla']
         self.gamma = self.C['gamma']
         self.batch_size = self.C['batch_size']
+        self.fused_fit = self.C['fused_fit']
+
+        # Prioritized experience replay, the importance sampling exponent being annealed over the trained batches
+        self.prioritized_replay = self.C['prioritized_replay']['enabled']
+        self.per_alpha = self.C['prioritized_replay']['alpha']
+        self.per_epsilon = self.C['prioritized_replay']['epsilon']
+        self.beta_init = self.C['prioritized_replay']['beta_init']
+        self.beta_stop = self.C['prioritized_replay']['beta_stop']
+        self.beta_decay = self.C['prioritized_replay']['beta_decay']
+        self.trained_batches = 0
+
+        # The memory can be filled by the dialogues while an asynchronous learner samples it
+        self.memory_lock = threading.Lock()
 
         self.load_weights_file_path = self.C['load_weights_file_path']
         self.save_weights_file_path = self.C['save_weights_file_path']
@@ -48,6 +64,7 @@ class DQNAgent:
             raise ValueError('Max memory size must be at least as great as batch size!')
 
         self.possible_actions = cfg.agent_actions
+        self.action_table = ActionTable(self.possible_actions)
         self.num_actions = len(self.possible_actions)
 
         self.action_counts = np.ones(self.num_actions)
@@ -55,10 +72,47 @@ class DQNAgent:
         self.rule_request_set = cfg.rule_requests
         self.rule_inform_set = cfg.rule_informs
 
+        # Indices of the actions of the rule-based policy
+        self.rule_greeting_index = self._map_action_to_index(
+            {const.INTENT: const.GREETING, const.INFORM_SLOTS: {}, const.REQUEST_SLOTS: {}})
+        self.rule_request_indices = [self._map_action_to_index(
+            {const.INTENT: const.REQUEST, const.INFORM_SLOTS: {}, const.REQUEST_SLOTS: {slot: const.UNKNOWN}})
+            for slot in self.rule_request_set]
+        self.rule_inform_indices = [self._map_action_to_index(
+            {const.INTENT: const.INFORM, const.INFORM_SLOTS: {slot: const.PLACEHOLDER}, const.REQUEST_SLOTS: {}})
+            for slot in self.rule_inform_set]
+        self.rule_match_found_index = self._map_action_to_index(
+            {const.INTENT: const.MATCH_FOUND, const.INFORM_SLOTS: {}, const.REQUEST_SLOTS: {}})
+        self.rule_closing_index = self._map_action_to_index(
+            {const.INTENT: const.CLOSING, const.INFORM_SLOTS: {}, const.REQUEST_SLOTS: {}})
+
         self.reset()
 
-    def build_models(self, state_size):
+    def build_models(self, state_size, dense_positions):
+        """
+        Builds the behavior and target models and the replay memory.
+
+        Parameters:
+            state_size (int): The state representation size or length of numpy array
+            dense_positions (numpy.array): The positions of the state representation that are not binary
+        """
+
         self.state_size = state_size
+
+        memory_name = self.C['replay_memory']
+        if memory_name == 'ReplayMemory':
+            self.memory = ReplayMemory(self.max_memory_size)
+        elif memory_name == 'ReplayBuffer':
+            self.memory = ReplayBuffer(self.max_memory_size)
+        elif memory_name == 'PackedReplayBuffer':
+            self.memory = PackedReplayBuffer(self.max_memory_size, dense_positions)
+        elif memory_name == 'AliasedReplayBuffer':
+            self.memory = AliasedReplayBuffer(self.max_memory_size)
+        else:
+            raise Exception(f"No such replay memory: {memory_name}")
+        if self.prioritized_replay:
+            self.memory = PrioritizedReplay(self.memory, self.per_alpha, self.per_epsilon)
+
         self.C['model']['input_dim'] = state_size
         self.C['model']['output_dim'] = self.num_actions
 
@@ -67,6 +121,15 @@ class DQNAgent:
 
         self.__load_weights()
 
+        # The one-state predictions of the behavior model can run in NumPy instead of Keras
+        inference = self.C['model']['inference']
+        if inference == 'numpy':
+            self.beh_inference = NumpyInference(self.beh_model)
+        elif inference == 'keras':
+            self.beh_inference = None
+        else:
+            raise Exception(f"No such inference: {inference}")
+
 
     def reset(self):
         """Resets the rule-based variables."""
@@ -93,30 +156,22 @@ class DQNAgent:
         if self.first_turn:
             self.first_turn = False
 
-            rule_response =  {const.INTENT: const.GREETING, const.INFORM_SLOTS: {},
-                            const.REQUEST_SLOTS: {}}
+            index = self.rule_greeting_index
         elif self.rule_current_request_slot_index < len(self.rule_request_set):
-            slot = self.rule_request_set[self.rule_current_request_slot_index]
+            index = self.rule_request_indices[self.rule_current_request_slot_index]
             self.rule_current_request_slot_index += 1
-
-            rule_response = {const.INTENT: const.REQUEST, const.INFORM_SLOTS: {},
-                             const.REQUEST_SLOTS: {slot: const.UNKNOWN}}
         elif self.rule_current_inform_slot_index < len(self.rule_inform_set):
-            slot = self.rule_inform_set[self.rule_current_inform_slot_index]
+            index = self.rule_inform_indices[self.rule_current_inform_slot_index]
             self.rule_current_inform_slot_index += 1
-
-            rule_response = {const.INTENT: const.INFORM, const.INFORM_SLOTS: {slot: const.PLACEHOLDER},
-                             const.REQUEST_SLOTS: {}}
         elif self.rule_phase == const.NOT_DONE:
-            rule_response = {const.INTENT: const.MATCH_FOUND, const.INFORM_SLOTS: {}, const.REQUEST_SLOTS: {}}
+            index = self.rule_match_found_index
             self.rule_phase = const.DONE
         elif self.rule_phase == const.DONE:
-            rule_response = {const.INTENT: const.CLOSING, const.INFORM_SLOTS: {}, const.REQUEST_SLOTS: {}}
+            index = self.rule_closing_index
         else:
             raise Exception('Should not have reached this clause')
 
-        index = self._map_action_to_index(rule_response)
-        return index, rule_response
+        return index, self._map_index_to_action(index)
 
     def _map_action_to_index(self, response):
         """
@@ -129,10 +184,10 @@ class DQNAgent:
             int
         """
 
-        for (i, action) in enumerate(self.possible_actions):
-            if response == action:
-                return i
-        raise ValueError(f'Response: {response} not found in possible actions')
+        index = self.action_table.index(response)
+        if index is None:
+            raise ValueError(f'Response: {response} not found in possible actions')
+        return index
 
     def _dqn_action(self, state):
         """
@@ -161,24 +216,25 @@ class DQNAgent:
             dict
         """
 
-        for (i, action) in enumerate(self.possible_actions):
-            if index == i:
-                return copy.deepcopy(action)
-        raise ValueError('Index: {} not in range of possible actions'.format(index))
+        if not 0 <= index < self.num_actions:
+            raise ValueError('Index: {} not in range of possible actions'.format(index))
+        return self.action_table.action(index)
 
     def _dqn_predict_one(self, state, target=False):
         """
         Returns a model prediction given a state.
 
         Parameters:
-            state (numpy.array)
+            state (numpy.array or SparseState)
             target (bool)
 
         Returns:
             numpy.array
         """
 
-        return self._dqn_predict(state.reshape(1, self.state_size), target=target).flatten()
+        if not target and self.beh_inference is not None:
+            return self.beh_inference.predict_one(state).copy()
+        return self._dqn_predict(stack_states([state]), target=target).flatten()
 
     def _dqn_predict(self, states, target=False):
         """
@@ -202,74 +258,159 @@ class DQNAgent:
         Adds an experience tuple made of the parameters to the memory.
 
         Parameters:
-            state (numpy.array)
+            state (numpy.array or SparseState)
             action (int)
             reward (int)
-            next_state (numpy.array)
+            next_state (numpy.array or SparseState)
             done (bool)
 
         """
 
-        if len(self.memory) < self.max_memory_size:
-            self.memory.append(None)
-        self.memory[self.memory_index] = (state, action, reward, next_state, done)
-        self.memory_index = (self.memory_index + 1) % self.max_memory_size
+        with self.memory_lock:
+            self.memory.add(state, action, reward, next_state, done)
 
     def empty_memory(self):
         """Empties the memory and resets the memory index."""
 
-        self.memory = []
-        self.memory_index = 0
+        with self.memory_lock:
+            self.memory.clear()
 
     def is_memory_full(self):
         """Returns true if the memory is full."""
 
-        return len(self.memory) == self.max_memory_size
+        return self.memory.is_full()
 
     def train(self):
         """
-        Trains the agent by improving the behavior model given the memory tuples.
+        Trains the agent by improving the behavior model given the memory experiences.
 
-        Takes batches of memories from the memory pool and processing them. The processing takes the tuples and stacks
-        them in the correct format for the neural network and calculates the Bellman equation for Q-Learning.
+        Takes batches of memories from the memory pool and processing them. The memory gives them stacked in the
+        correct format for the neural network and the Bellman equation for Q-Learning is calculated.
+
+        With prioritized replay, the batches are sampled by priority, the losses are weighted by the importance
+        sampling weights and the priorities of the batch are updated with its TD errors.
+
+        With the fused fit, all the batches are sampled and given their targets at once, then trained on in a single
+        fit call. The target model is the same for all of them, as it only changes in copy, but the behavior model
+        predictions in the targets are those of the model before the training instead of after the previous batch.
 
         """
         # Calc. num of batches to run
         num_batches = len(self.memory) // self.batch_size
-        for b in range(num_batches):
-            batch = random.sample(self.memory, self.batch_size)
+        if num_batches == 0:
+            return
+        if self.fused_fit:
+            self.__fit_batches(num_batches)
+        else:
+            for b in range(num_batches):
+                self.__fit_batches(1)
+
+        self.refresh_inference()
 
-            states = np.array([sample[0] for sample in batch])
-            next_states = np.array([sample[3] for sample in batch])
+    def train_batch(self):
+        """
+        Trains the behavior model on a single batch of the memory, for an asynchronous learner.
+
+        The weights are not published to the NumPy inference, see refresh_inference.
+
+        Returns:
+            bool: False if the memory has fewer experiences than a batch, nothing being trained
+        """
+
+        return self.__fit_batches(1)
 
-            assert states.shape == (self.batch_size, self.state_size), 'States Shape: {}'.format(states.shape)
-            assert next_states.shape == states.shape
+    def __fit_batches(self, num_batches):
+        """
+        Samples batches from the memory, computes their targets and fits the behavior model on them.
+
+        Parameters:
+            num_batches (int): The number of batches
+
+        Returns:
+            bool: False if the memory has fewer experiences than the batches, nothing being trained
+        """
 
-            beh_state_preds = self._dqn_predict(states)  # For leveling error
-            if not self.vanilla:
-                beh_next_states_preds = self._dqn_predict(next_states)  # For indexing for DDQN
+        size = num_batches * self.batch_size
+        weights = None
+        with self.memory_lock:
+            if len(self.memory) < size:
+                return False
+            if self.prioritized_replay:
+                beta = self.__update_beta(self.trained_batches)
+                states, actions, rewards, next_states, dones, indices, weights = \
+                    self.memory.sample_prioritized(size, beta)
+                write_stamps = self.memory.get_write_stamps(indices)
             else:
-                tar_next_state_preds = self._dqn_predict(next_states, target=True)  # For target value for DQN (& DDQN)
+                states, actions, rewards, next_states, dones = self.memory.sample(self.batch_size, num_batches)
 
-            inputs = np.zeros((self.batch_size, self.state_size))
-            targets = np.zeros((self.batch_size, self.num_actions))
+        assert states.shape == (size, self.state_size), 'States Shape: {}'.format(states.shape)
+        assert next_states.shape == states.shape
 
-            for i, (s, a, r, s_, d) in enumerate(batch):
-                t = beh_state_preds[i]
-                if not self.vanilla:
-                    t[a] = r + self.gamma * tar_next_state_preds[i][np.argmax(beh_next_states_preds[i])] * (not d)
-                else:
-                    t[a] = r + self.gamma * np.amax(tar_next_state_preds[i]) * (not d)
+        targets, td_errors = self._compute_targets(states, actions, rewards, next_states, dones)
+        self.beh_model.fit(states, targets, sample_weight=weights, batch_size=self.batch_size, epochs=1, verbose=0,
+                           shuffle=False)
 
-                inputs[i] = s
-                targets[i] = t
+        # The lock is not held during the fit, the experiences replaced in the meantime keep their priorities
+        if self.prioritized_replay:
+            with self.memory_lock:
+                self.memory.update_priorities(indices, td_errors, write_stamps)
+        self.trained_batches += num_batches
+        return True
 
-            self.beh_model.fit(inputs, targets, epochs=1, verbose=0)
+    def _compute_targets(self, states, actions, rewards, next_states, dones):
+        """
+        Returns the targets of a batch given by the Bellman equation, for DQN (vanilla) or Double DQN, and the TD errors
+        of the taken actions.
+
+        The targets are the behavior model predictions (for leveling error), except for the taken actions. Double DQN
+        predicts the states and the next states with the behavior model in a single call.
+
+        Parameters:
+            states (numpy.array): The states, of shape (batch size, state size)
+            actions (numpy.array): The indices of the actions taken
+            rewards (numpy.array): The rewards
+            next_states (numpy.array): The next states, of shape (batch size, state size)
+            dones (numpy.array): The done flags
+
+        Returns:
+            numpy.array: The targets, of shape (batch size, num actions)
+            numpy.array: The TD errors, of shape (batch size,)
+        """
+
+        rows = np.arange(len(actions))
+        # For target value for DQN (& DDQN)
+        tar_next_state_preds = self._dqn_predict(next_states, target=True)
+        if self.vanilla:
+            beh_state_preds = self._dqn_predict(states)
+            next_values = np.amax(tar_next_state_preds, axis=1)
+        else:
+            beh_preds = self._dqn_predict(np.concatenate([states, next_states]))
+            beh_state_preds, beh_next_states_preds = beh_preds[:len(actions)], beh_preds[len(actions):]
+            # Indexing for DDQN
+            next_values = tar_next_state_preds[rows, np.argmax(beh_next_states_preds, axis=1)]
+
+        targets = np.array(beh_state_preds, dtype=np.float64)
+        targets[rows, actions] = rewards + self.gamma * next_values * ~dones
+        td_errors = targets[rows, actions] - beh_state_preds[rows, actions]
+        return targets, td_errors
+
+    def __update_beta(self, step):
+        # Linear annealing of the importance sampling exponent
+        a = float(self.beta_stop - self.beta_init) / self.beta_decay
+        b = float(self.beta_init)
+        return min(self.beta_stop, a * float(step) + b)
 
     def copy(self):
         """Copies the behavior model's weights into the target model's weights."""
 
         self.tar_model.set_weights(self.beh_model.get_weights())
+        self.refresh_inference()
+
+    def refresh_inference(self):
+        """Copies the weights of the behavior model into its NumPy inference, if used."""
+
+        if self.beh_inference is not None:
+            self.beh_inference.refresh()
 
     def save_weights(self):
         """Saves the weights of both models in two h5 files."""
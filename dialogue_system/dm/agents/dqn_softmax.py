@@ -61,7 +61,7 @@ class DQNSoftmax(DQNAgent):
 
                 # Softmax
 
-                q_values = self._dqn_predict(state.reshape(1, self.state_size))
+                q_values = self._dqn_predict_one(state)
                 q_modified = q_values / self.tau
                 q_max = np.max(q_modified)
                 exp_values = np.exp(q_modified - q_max)
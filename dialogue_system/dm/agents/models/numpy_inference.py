@@ -0,0 +1,86 @@
+from dialogue_system.dm.dst.state_encoder import SparseState
+import numpy as np
+
+
+def _relu(x):
+    np.maximum(x, 0., out=x)
+
+
+def _tanh(x):
+    np.tanh(x, out=x)
+
+
+def _sigmoid(x):
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1.
+    np.reciprocal(x, out=x)
+
+
+def _linear(x):
+    pass
+
+
+# In-place activation functions, by Keras name
+ACTIVATIONS = {'relu': _relu, 'tanh': _tanh, 'sigmoid': _sigmoid, 'linear': _linear}
+
+
+class NumpyInference:
+    """
+    Runs the forward pass of a Keras model made of Dense layers directly in NumPy, for the one-state predictions of
+    the agent, without the per-call overhead of model.predict.
+    """
+
+    def __init__(self, model):
+        """
+        The constructor for NumpyInference.
+
+        Parameters:
+            model (keras.Model): The model, a stack of Dense layers
+        """
+
+        self.model = model
+        self.activations = []
+        for layer in model.layers:
+            activation = layer.get_config()['activation']
+            if activation not in ACTIVATIONS:
+                raise ValueError(f'Activation {activation} is not supported by the NumPy inference')
+            self.activations.append(ACTIVATIONS[activation])
+        self.refresh()
+
+    def refresh(self):
+        """
+        Copies the weights of the model, to be called whenever they change (train, copy or load).
+
+        The copy is published with a single assignment, so that a forward pass running in another thread uses either
+        the previous weights or the new ones, never a mix of both.
+        """
+
+        params = []
+        for layer, activation in zip(self.model.layers, self.activations):
+            kernel, bias = layer.get_weights()
+            # Each layer with its own output buffer
+            params.append((np.ascontiguousarray(kernel, dtype=np.float32), np.ascontiguousarray(bias, dtype=np.float32),
+                           activation, np.zeros(bias.shape, dtype=np.float32)))
+        self._params = tuple(params)
+
+    def predict_one(self, state):
+        """
+        Returns the output of the model given a state.
+
+        Parameters:
+            state (numpy.array or SparseState)
+
+        Returns:
+            numpy.array: A float32 numpy array of shape (output size,), overwritten by the next call
+        """
+
+        if isinstance(state, SparseState):
+            state = state.to_dense()
+        output = np.asarray(state, dtype=np.float32)
+        for kernel, bias, activation, layer_output in self._params:
+            np.dot(output, kernel, out=layer_output)
+            layer_output += bias
+            activation(layer_output)
+            output = layer_output
+        return output
@@ -0,0 +1,548 @@
+from dialogue_system.dm.dst.state_encoder import SparseState, stack_states
+from dialogue_system.dm.agents.sum_tree import SumTree
+import numpy as np
+import random
+
+
+class ReplayMemory:
+    """The replay memory of the agent as a list of (state, action, reward, next_state, done) tuples."""
+
+    def __init__(self, capacity):
+        """
+        The constructor for ReplayMemory.
+
+        Parameters:
+            capacity (int): The maximum number of experiences, the oldest ones being overwritten
+        """
+
+        self.capacity = capacity
+        self.clear()
+
+    def add(self, state, action, reward, next_state, done):
+        """
+        Adds an experience tuple made of the parameters to the memory.
+
+        Parameters:
+            state (numpy.array or SparseState)
+            action (int)
+            reward (int)
+            next_state (numpy.array or SparseState)
+            done (bool)
+        """
+
+        if len(self.memory) < self.capacity:
+            self.memory.append(None)
+        self.memory[self.index] = (state, action, reward, next_state, done)
+        self.index = (self.index + 1) % self.capacity
+
+    def sample(self, batch_size, num_batches=1):
+        """
+        Samples batches of experiences uniformly, each without replacement.
+
+        Parameters:
+            batch_size (int): The number of experiences of a batch
+            num_batches (int): The number of batches, concatenated. Default: 1
+
+        Returns:
+            tuple: The states, actions, rewards, next states and done flags of the experiences, as numpy arrays
+        """
+
+        return self.gather([index for _ in range(num_batches)
+                            for index in random.sample(range(len(self.memory)), batch_size)])
+
+    def gather(self, indices):
+        """
+        Returns the experiences at some indices of the memory.
+
+        Parameters:
+            indices (list or numpy.array): The indices
+
+        Returns:
+            tuple: The states, actions, rewards, next states and done flags of the experiences, as numpy arrays
+        """
+
+        batch = [self.memory[index] for index in indices]
+
+        # Sparse states are stored as they are and only made dense here, a batch at once
+        states = stack_states([sample[0] for sample in batch])
+        next_states = stack_states([sample[3] for sample in batch])
+        actions = np.array([sample[1] for sample in batch])
+        rewards = np.array([sample[2] for sample in batch], dtype=np.float64)
+        dones = np.array([sample[4] for sample in batch], dtype=np.bool_)
+        return states, actions, rewards, next_states, dones
+
+    def clear(self):
+        """Empties the memory and resets the memory index."""
+
+        self.memory = []
+        self.index = 0
+
+    def is_full(self):
+        """Returns true if the memory is full."""
+
+        return len(self.memory) == self.capacity
+
+    def __len__(self):
+        return len(self.memory)
+
+
+class ReplayBuffer:
+    """
+    The replay memory of the agent as a ring buffer of preallocated arrays, one per element of the experiences.
+
+    The arrays are allocated at the first experience, when the state size is known.
+    """
+
+    def __init__(self, capacity):
+        """
+        The constructor for ReplayBuffer.
+
+        Parameters:
+            capacity (int): The maximum number of experiences, the oldest ones being overwritten
+        """
+
+        self.capacity = capacity
+        self.states = None
+        self.clear()
+
+    def allocate(self, state_size):
+        """
+        Allocates the arrays of the buffer.
+
+        Parameters:
+            state_size (int): The state representation size
+        """
+
+        self.states = np.zeros((self.capacity, state_size), dtype=np.float32)
+        self.next_states = np.zeros((self.capacity, state_size), dtype=np.float32)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float64)
+        self.dones = np.zeros(self.capacity, dtype=np.bool_)
+
+    def add(self, state, action, reward, next_state, done):
+        """
+        Adds an experience made of the parameters to the buffer, in O(1).
+
+        Parameters:
+            state (numpy.array or SparseState)
+            action (int)
+            reward (int)
+            next_state (numpy.array or SparseState)
+            done (bool)
+        """
+
+        if self.states is None:
+            self.allocate(state.size)
+
+        index = self.index
+        self._store_state(self.states, index, state)
+        self._store_state(self.next_states, index, next_state)
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.dones[index] = done
+
+        self.index = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _store_state(self, states, index, state):
+        """
+        Writes a state, dense or sparse, in a row of the states or next states.
+
+        Parameters:
+            states (numpy.array): The states or next states array
+            index (int): The row
+            state (numpy.array or SparseState)
+        """
+
+        if isinstance(state, SparseState):
+            state.to_dense(out=states[index])
+        else:
+            states[index] = state
+
+    def _load_states(self, states, indices):
+        """
+        Returns the rows of the states or next states.
+
+        Parameters:
+            states (numpy.array): The states or next states array
+            indices (numpy.array): The rows
+
+        Returns:
+            numpy.array: A float32 numpy array of shape (number of indices, state size)
+        """
+
+        return states[indices]
+
+    def sample(self, batch_size, num_batches=1):
+        """
+        Samples batches of experiences uniformly, each without replacement, gathering them from the arrays by index.
+
+        The indices of all the batches are drawn at once with NumPy: as the first indices of random permutations if the
+        buffer is small, else with replacement, the rare batches with a repeated index being drawn again.
+
+        Parameters:
+            batch_size (int): The number of experiences of a batch
+            num_batches (int): The number of batches, concatenated. Default: 1
+
+        Returns:
+            tuple: The states, actions, rewards, next states and done flags of the experiences, as numpy arrays
+        """
+
+        if batch_size > self.size:
+            raise ValueError(f'Cannot sample {batch_size} experiences out of {self.size}')
+
+        if batch_size ** 2 > self.size:
+            indices = np.argsort(np.random.random((num_batches, self.size)), axis=1)[:, :batch_size]
+        else:
+            indices = np.random.randint(self.size, size=(num_batches, batch_size))
+            repeated = self.__has_repeated_index(indices)
+            while repeated.any():
+                indices[repeated] = np.random.randint(self.size, size=(np.count_nonzero(repeated), batch_size))
+                repeated = self.__has_repeated_index(indices)
+        return self.gather(indices.ravel())
+
+    @staticmethod
+    def __has_repeated_index(indices):
+        """Returns a bool array of shape (number of batches,), true for the batches holding an index twice."""
+
+        sorted_indices = np.sort(indices, axis=1)
+        return (sorted_indices[:, 1:] == sorted_indices[:, :-1]).any(axis=1)
+
+    def gather(self, indices):
+        """
+        Returns the experiences at some indices of the buffer.
+
+        Parameters:
+            indices (numpy.array): The indices
+
+        Returns:
+            tuple: The states, actions, rewards, next states and done flags of the experiences, as numpy arrays
+        """
+
+        return (self._load_states(self.states, indices), self.actions[indices], self.rewards[indices],
+                self._load_states(self.next_states, indices), self.dones[indices])
+
+    def clear(self):
+        """Empties the buffer and resets its index, the arrays are kept."""
+
+        self.index = 0
+        self.size = 0
+
+    def is_full(self):
+        """Returns true if the buffer is full."""
+
+        return self.size == self.capacity
+
+    def __len__(self):
+        return self.size
+
+
+class PackedReplayBuffer(ReplayBuffer):
+    """
+    A ring buffer replay memory keeping the states bit-packed: the binary positions of a state are packed in bits and
+    only its continuous positions (the turn and the KB scaled counts) are kept as float16 values.
+
+    A state of the movie dialogues takes 84 bytes instead of 904 as float32 (turn and counts lose some precision).
+    """
+
+    def __init__(self, capacity, dense_positions):
+        """
+        The constructor for PackedReplayBuffer.
+
+        Parameters:
+            capacity (int): The maximum number of experiences, the oldest ones being overwritten
+            dense_positions (numpy.array): The positions of the state representation that are not binary
+        """
+
+        self.dense_positions = np.asarray(dense_positions)
+        super().__init__(capacity)
+
+    def allocate(self, state_size):
+        """
+        Allocates the arrays of the buffer, the states being (bits, values) pairs of arrays.
+
+        Parameters:
+            state_size (int): The state representation size
+        """
+
+        binary_mask = np.ones(state_size, dtype=np.bool_)
+        binary_mask[self.dense_positions] = False
+        self.binary_positions = np.flatnonzero(binary_mask)
+        self.state_size = state_size
+        self.scratch = np.zeros(state_size, dtype=np.float32)
+
+        num_bytes = (len(self.binary_positions) + 7) // 8
+        self.states = (np.zeros((self.capacity, num_bytes), dtype=np.uint8),
+                       np.zeros((self.capacity, len(self.dense_positions)), dtype=np.float16))
+        self.next_states = (np.zeros((self.capacity, num_bytes), dtype=np.uint8),
+                            np.zeros((self.capacity, len(self.dense_positions)), dtype=np.float16))
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float64)
+        self.dones = np.zeros(self.capacity, dtype=np.bool_)
+
+    def _store_state(self, states, index, state):
+        """Packs a state, dense or sparse, in a row of the states or next states."""
+
+        if isinstance(state, SparseState):
+            state = state.to_dense(out=self.scratch)
+        bits, values = states
+        bits[index] = np.packbits(state[self.binary_positions] != 0.)
+        values[index] = state[self.dense_positions]
+
+    def _load_states(self, states, indices):
+        """Unpacks the rows of the states or next states."""
+
+        bits, values = states
+        matrix = np.zeros((len(indices), self.state_size), dtype=np.float32)
+        matrix[:, self.binary_positions] = np.unpackbits(bits[indices], axis=1)[:, :len(self.binary_positions)]
+        matrix[:, self.dense_positions] = values[indices]
+        return matrix
+
+
+class AliasedReplayBuffer(ReplayBuffer):
+    """
+    A ring buffer replay memory keeping each state once: inside a dialogue, the next state of an experience is the
+    state of the experience added after it, so it is read from the next row of the states instead of being stored.
+
+    The next state of an experience is one of:
+        - the state of the next experience (the common case);
+        - zeros, for a terminal experience whose next state is the zero state of the tracker;
+        - the pending next state, for the last experience added, until the next experience comes;
+        - a spare copy, for an experience whose next state is none of the above (e.g. a dialogue left unfinished).
+    """
+
+    NEXT_ROW = 0
+    ZEROS = 1
+    PENDING = 2
+    SPARE = 3
+
+    def allocate(self, state_size):
+        """
+        Allocates the arrays of the buffer, with no next states array.
+
+        Parameters:
+            state_size (int): The state representation size
+        """
+
+        self.states = np.zeros((self.capacity, state_size), dtype=np.float32)
+        self.next_kinds = np.zeros(self.capacity, dtype=np.int8)
+        self.pending_state = np.zeros((1, state_size), dtype=np.float32)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float64)
+        self.dones = np.zeros(self.capacity, dtype=np.bool_)
+
+    def add(self, state, action, reward, next_state, done):
+        """
+        Adds an experience made of the parameters to the buffer, in O(1), linking the last experience to it.
+
+        Parameters:
+            state (numpy.array or SparseState)
+            action (int)
+            reward (int)
+            next_state (numpy.array or SparseState)
+            done (bool)
+        """
+
+        if self.states is None:
+            self.allocate(state.size)
+
+        index = self.index
+        self.spare_next_states.pop(index, None)
+        # The dialogue system passes the next state of an experience as the state of the next one
+        if self.pending is not None and state is self.pending:
+            self.states[index] = self.pending_state[0]
+            self.next_kinds[(index - 1) % self.capacity] = self.NEXT_ROW
+        else:
+            self._store_state(self.states, index, state)
+            if self.pending is not None:
+                self.__link(index)
+
+        self._store_state(self.pending_state, 0, next_state)
+        if not done:
+            self.next_kinds[index] = self.PENDING
+            self.pending = next_state
+        else:
+            self.__close(index)
+            self.pending = None
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.dones[index] = done
+
+        self.index = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def __link(self, index):
+        """Sets the next state of the last experience, whose next state is pending, given the new one at index."""
+
+        last = (index - 1) % self.capacity
+        if np.array_equal(self.states[index], self.pending_state[0]):
+            self.next_kinds[last] = self.NEXT_ROW
+        else:
+            self.__close(last)
+
+    def __close(self, index):
+        """Keeps the pending state as the next state of an experience that no experience follows."""
+
+        if not self.pending_state.any():
+            self.next_kinds[index] = self.ZEROS
+        else:
+            self.next_kinds[index] = self.SPARE
+            self.spare_next_states[index] = self.pending_state[0].copy()
+
+    def gather(self, indices):
+        """
+        Returns the experiences at some indices of the buffer, the next states being read from the next rows.
+
+        Parameters:
+            indices (numpy.array): The indices
+
+        Returns:
+            tuple: The states, actions, rewards, next states and done flags of the experiences, as numpy arrays
+        """
+
+        next_states = self._load_states(self.states, (indices + 1) % self.capacity)
+        next_kinds = self.next_kinds[indices]
+        next_states[next_kinds == self.ZEROS] = 0.
+        next_states[next_kinds == self.PENDING] = self.pending_state[0]
+        for row in np.flatnonzero(next_kinds == self.SPARE):
+            next_states[row] = self.spare_next_states[indices[row]]
+        return (self._load_states(self.states, indices), self.actions[indices], self.rewards[indices], next_states,
+                self.dones[indices])
+
+    def clear(self):
+        """Empties the buffer and resets its index, the arrays are kept."""
+
+        super().clear()
+        self.pending = None
+        self.spare_next_states = {}
+
+
+class PrioritizedReplay:
+    """
+    Prioritized experience replay (Schaul et al., 2016) over a replay memory: the experiences are sampled with
+    probabilities proportional to their priorities, kept in a sum tree, and the priorities are the absolute TD errors
+    of their last training.
+
+    The new experiences get the maximum priority seen so far, so that they are trained on at least once. Each write
+    of an experience is stamped, so that the TD errors of a batch are not given to the experiences that replaced the
+    sampled ones while it was trained on (e.g. by an asynchronous learner).
+    """
+
+    def __init__(self, memory, alpha, epsilon):
+        """
+        The constructor for PrioritizedReplay.
+
+        Parameters:
+            memory (ReplayMemory, ReplayBuffer or PackedReplayBuffer): The memory keeping the experiences
+            alpha (float): How much the priorities count, 0 being uniform sampling
+            epsilon (float): Added to the absolute TD errors, so that no experience has a zero priority
+        """
+
+        self.memory = memory
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.tree = SumTree(memory.capacity)
+        self.max_priority = 1.0
+        # The stamp of the last write of each experience, -1 for the empty ones
+        self.write_stamps = np.full(memory.capacity, -1, dtype=np.int64)
+        self.num_writes = 0
+
+    def add(self, state, action, reward, next_state, done):
+        """
+        Adds an experience made of the parameters to the memory, with the maximum priority, in O(log n).
+
+        Parameters:
+            state (numpy.array or SparseState)
+            action (int)
+            reward (int)
+            next_state (numpy.array or SparseState)
+            done (bool)
+        """
+
+        index = self.memory.index
+        self.memory.add(state, action, reward, next_state, done)
+        self.tree.update([index], [self.max_priority ** self.alpha])
+        self.write_stamps[index] = self.num_writes
+        self.num_writes += 1
+
+    def sample(self, batch_size, num_batches=1):
+        """Samples batches of experiences uniformly, each without replacement, ignoring the priorities."""
+
+        return self.memory.sample(batch_size, num_batches)
+
+    def sample_prioritized(self, batch_size, beta):
+        """
+        Samples experiences proportionally to their priorities, one in each of batch_size equal segments of the total
+        priority, in O(batch size * log n).
+
+        Parameters:
+            batch_size (int): The number of experiences
+            beta (float): The importance sampling exponent, 1 fully compensating the non uniform sampling
+
+        Returns:
+            tuple: The states, actions, rewards, next states and done flags of the experiences, their indices and their
+                   importance sampling weights normalized by the largest one, as numpy arrays
+        """
+
+        total = self.tree.total()
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * segment
+        # Rounding errors can lead past the last experience, to the empty leaves
+        indices = np.minimum(self.tree.find(values), len(self) - 1)
+
+        probabilities = self.tree.get(indices) / total
+        weights = (len(self) * probabilities) ** -beta
+        weights /= weights.max()
+        return self.memory.gather(indices) + (indices, weights)
+
+    def get_write_stamps(self, indices):
+        """
+        Returns the write stamps of experiences, to be given back to update_priorities.
+
+        Parameters:
+            indices (numpy.array): The indices of the experiences
+
+        Returns:
+            numpy.array: An int64 numpy array of the same shape as the indices
+        """
+
+        return self.write_stamps[indices]
+
+    def update_priorities(self, indices, td_errors, write_stamps=None):
+        """
+        Sets the priorities of experiences from their TD errors, in O(batch size * log n).
+
+        Parameters:
+            indices (numpy.array): The indices of the experiences
+            td_errors (numpy.array): Their TD errors
+            write_stamps (numpy.array): The write stamps of the experiences when they were sampled, the experiences
+                                        written since then being skipped. Default: None (no experience is skipped)
+        """
+
+        if write_stamps is not None:
+            unchanged = self.write_stamps[indices] == write_stamps
+            indices = indices[unchanged]
+            td_errors = td_errors[unchanged]
+            if len(indices) == 0:
+                return
+
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def clear(self):
+        """Empties the memory and resets the priorities."""
+
+        self.memory.clear()
+        self.tree.clear()
+        self.max_priority = 1.0
+        # The stamps keep increasing, so that the experiences sampled before are not taken for the new ones
+        self.write_stamps[:] = -1
+
+    def is_full(self):
+        """Returns true if the memory is full."""
+
+        return self.memory.is_full()
+
+    def __len__(self):
+        return len(self.memory)
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class SumTree:
+    """
+    A binary tree whose leaves are the priorities of the experiences and whose nodes are the sums of their children,
+    for sampling proportionally to the priorities and updating them in O(log n).
+
+    The tree is stored in an array: the root is at 1, the children of node i at 2i and 2i + 1, and the leaves start at
+    the first power of 2 not less than the capacity. The operations work on batches of leaves at once, level by level.
+    """
+
+    def __init__(self, capacity):
+        """
+        The constructor for SumTree.
+
+        Parameters:
+            capacity (int): The number of leaves
+        """
+
+        self.capacity = capacity
+        self.leaf_start = 1
+        while self.leaf_start < capacity:
+            self.leaf_start *= 2
+        self.nodes = np.zeros(2 * self.leaf_start, dtype=np.float64)
+
+    def total(self):
+        """Returns the sum of all priorities."""
+
+        return self.nodes[1]
+
+    def get(self, indices):
+        """Returns the priorities of the leaves."""
+
+        return self.nodes[self.leaf_start + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        """
+        Sets the priorities of leaves and updates the sums above them.
+
+        Parameters:
+            indices (numpy.array): The indices of the leaves
+            priorities (numpy.array): Their new priorities
+        """
+
+        nodes = self.leaf_start + np.asarray(indices)
+        self.nodes[nodes] = priorities
+        # The leaves are all at the same depth, and a parent met several times gets the same sum each time
+        nodes //= 2
+        while nodes[0] >= 1:
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+            nodes //= 2
+
+    def find(self, values):
+        """
+        Returns the leaves where the cumulative sums of the priorities reach the values.
+
+        Parameters:
+            values (numpy.array): Values in [0, total)
+
+        Returns:
+            numpy.array: The indices of the leaves
+        """
+
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaf_start:
+            nodes *= 2
+            left_sums = self.nodes[nodes]
+            go_right = values >= left_sums
+            values -= left_sums * go_right
+            nodes += go_right
+        return nodes - self.leaf_start
+
+    def clear(self):
+        """Sets all priorities to 0."""
+
+        self.nodes.fill(0.)
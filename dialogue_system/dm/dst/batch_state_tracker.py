@@ -0,0 +1,251 @@
+from dialogue_system.dm.dst.state_tracker import create_db_helper, add_inform, augment_agent_action
+from dialogue_system.dm.dst.state_encoder import StateEncoder
+from utils.util import convert_list_to_dict
+import dialogue_system.dialogue_config as cfg
+import dialogue_system.constants as const
+import numpy as np
+
+
+class BatchStateTracker:
+    """Tracks the state of many concurrent episodes/conversations and encodes their states at once, as a matrix."""
+
+    def __init__(self, config, num_dialogues):
+        """
+        The constructor of BatchStateTracker.
+
+        The dialogues are held in a structured array, one record per dialogue, updated as the actions come:
+            round_num: the current round number
+            num_actions: the length of the history
+            intent: the intent index of the last action (column 0) and of the one before it (column 1), -1 if none
+            inform_slots, request_slots: the bags of slots of the last action and of the one before it
+            current_informs: the value of each slot in the current informs, None if it is not informed
+            current_slots: the bag of filled_in slots based on the current informs
+
+        All dialogues share one DB query object, and so its caches.
+
+        Parameters:
+            config (dict): Loaded config in dict
+            num_dialogues (int): The number of concurrent dialogues
+        """
+
+        self.db_helper = create_db_helper(config)
+        self.num_dialogues = num_dialogues
+
+        self.intents_dict = convert_list_to_dict(cfg.all_intents)
+        self.slots_dict = convert_list_to_dict(cfg.all_slots)
+        self.slots = list(cfg.all_slots)
+        self.num_slots = len(cfg.all_slots)
+        self.max_round_num = config['run']['max_round_num']
+        state_encoder = StateEncoder(self.intents_dict, self.slots_dict, self.max_round_num)
+        self.offsets = state_encoder.offsets
+        self.state_size = state_encoder.state_size
+
+        self.dialogues = np.zeros(num_dialogues, dtype=[('round_num', np.int32), ('num_actions', np.int32),
+                                                        ('intent', np.int32, (2,)),
+                                                        ('inform_slots', np.bool_, (2, self.num_slots)),
+                                                        ('request_slots', np.bool_, (2, self.num_slots)),
+                                                        ('current_informs', object, (self.num_slots,)),
+                                                        ('current_slots', np.bool_, (self.num_slots,))])
+        self.reset()
+
+    def get_state_size(self):
+        """Returns the state size of the state representation used by the agent."""
+
+        return self.state_size
+
+    def reset(self, dialogue=None):
+        """
+        Resets the dialogues, and the last query of the DB helper.
+
+        Parameters:
+            dialogue (int): The index of the dialogue to be reset, None to reset all of them. Default: None
+        """
+
+        dialogues = slice(None) if dialogue is None else dialogue
+        for field in self.dialogues.dtype.names:
+            self.dialogues[field][dialogues] = 0
+        self.dialogues['intent'][dialogues] = -1
+        self.dialogues['current_informs'][dialogues] = None
+        self.db_helper.reset()
+
+    def get_current_informs(self, dialogue):
+        """
+        Returns the current informs of a dialogue.
+
+        Parameters:
+            dialogue (int): The index of the dialogue
+
+        Returns:
+            dict: The informed slots and their values, in the order of the slots
+        """
+
+        values = self.dialogues['current_informs'][dialogue]
+        return {self.slots[slot]: values[slot] for slot in np.flatnonzero(self.dialogues['current_slots'][dialogue])}
+
+    def get_suggest_slots_values(self, dialogue, request_slots):
+        """ Get the suggested values for request slots of a dialogue """
+
+        suggest_slot_vals = {}
+        if len(request_slots) > 0:
+            suggest_slot_vals = self.db_helper.suggest_slot_values(request_slots, self.get_current_informs(dialogue))
+
+        return suggest_slot_vals
+
+    def get_current_kb_results(self, dialogue):
+        """ get the kb_results for current state of a dialogue """
+
+        return self.db_helper.get_db_results(self.get_current_informs(dialogue))
+
+    def get_state(self, done=None):
+        """
+        Returns the state representations of all dialogues, each row as the one of StateTracker.get_state.
+
+        The one-hot and bag of slots representations are scattered from the structured array at once. The KB counts
+        are looked up once per distinct set of current informs, with the cached DB query object, and scattered to the
+        dialogues that have it.
+
+        Parameters:
+            done (numpy.array): A bool array of shape (num dialogues,), the rows of the dialogues that are done are
+                                filled with zeros. Default: None (no dialogue is done)
+
+        Returns:
+            numpy.array: A float32 numpy array of shape (num dialogues, state size)
+        """
+
+        offsets = self.offsets
+        dialogues = self.dialogues
+        num_slots = self.num_slots
+        rows = np.arange(self.num_dialogues)
+        states = np.zeros((self.num_dialogues, self.state_size), dtype=np.float32)
+
+        # The last action (if any) is the user one and the one before it (if any) the agent one, the intent of a
+        # missing action being -1
+        user_rows = rows[dialogues['num_actions'] > 0]
+        states[user_rows, offsets['user_act'] + dialogues['intent'][user_rows, 0]] = 1.0
+        states[:, offsets['user_inform_slots']:offsets['user_inform_slots'] + num_slots] = \
+            dialogues['inform_slots'][:, 0]
+        states[:, offsets['user_request_slots']:offsets['user_request_slots'] + num_slots] = \
+            dialogues['request_slots'][:, 0]
+
+        agent_rows = rows[dialogues['num_actions'] > 1]
+        states[agent_rows, offsets['agent_act'] + dialogues['intent'][agent_rows, 1]] = 1.0
+        states[agent_rows, offsets['agent_inform_slots']:offsets['agent_inform_slots'] + num_slots] = \
+            dialogues['inform_slots'][agent_rows, 1]
+        states[agent_rows, offsets['agent_request_slots']:offsets['agent_request_slots'] + num_slots] = \
+            dialogues['request_slots'][agent_rows, 1]
+
+        states[:, offsets['current_slots']:offsets['current_slots'] + num_slots] = dialogues['current_slots']
+
+        # Value and one-hot representations of the round num, index -1 being the last one as in StateTracker
+        states[:, offsets['turn']] = dialogues['round_num'] / 5.
+        states[rows, offsets['turn_onehot'] + (dialogues['round_num'] - 1) % self.max_round_num] = 1.0
+
+        # Representation of DB query results, the last position (and the missing slots) is for all constraints
+        counts = self.__count_database()
+        states[:, offsets['kb_binary']:offsets['kb_binary'] + num_slots + 1] = counts > 0.
+        states[:, offsets['kb_count']:offsets['kb_count'] + num_slots + 1] = counts / 100.
+
+        if done is not None:
+            states[done] = 0.
+        return states
+
+    def __count_database(self):
+        """
+        Returns the KB counts of the current informs of all dialogues, as DBQuery.get_db_results_for_slots gives them.
+
+        Returns:
+            numpy.array: The counts, of shape (num dialogues, num slots + 1), the last column for all constraints
+        """
+
+        # The dialogues with the same current informs share one lookup
+        inverse = np.empty(self.num_dialogues, dtype=np.int64)
+        distinct = {}
+        for i, values in enumerate(self.dialogues['current_informs']):
+            inverse[i] = distinct.setdefault(tuple(values), len(distinct))
+
+        distinct_counts = np.zeros((len(distinct), self.num_slots + 1))
+        for values, row in distinct.items():
+            current_informs = {self.slots[slot]: value for slot, value in enumerate(values) if value is not None}
+            db_results_dict = self.db_helper.get_db_results_for_slots(current_informs)
+            distinct_counts[row] = db_results_dict[const.KB_MATCHING_ALL_CONSTRAINTS]
+            for key, count in db_results_dict.items():
+                if key in self.slots_dict:
+                    distinct_counts[row, self.slots_dict[key]] = count
+        return distinct_counts[inverse]
+
+    def update_state_agent(self, dialogue, agent_action):
+        """
+        Updates the dialogue history with the agent's action and augments the agent's action, as
+        StateTracker.update_state_agent does.
+
+        Parameters:
+            dialogue (int): The index of the dialogue
+            agent_action (dict): The agent action of format dict('intent': '', 'inform_slots': {},
+                                 'request_slots': {}) and changed to dict('intent': '', 'inform_slots': {},
+                                 'request_slots': {}, 'round': int, 'speaker': 'Agent')
+        """
+
+        current_informs = self.get_current_informs(dialogue)
+        augment_agent_action(self.db_helper, agent_action, current_informs, int(self.dialogues['round_num'][dialogue]))
+        self.__set_informs(dialogue, current_informs)
+        self.__record_action(dialogue, agent_action)
+
+    def update_state_user(self, dialogue, user_action):
+        """
+        Updates the dialogue history with the user's action and augments the user's action, as
+        StateTracker.update_state_user does.
+
+        Parameters:
+            dialogue (int): The index of the dialogue
+            user_action (dict): The user action of format dict('intent': '', 'inform_slots': {},
+                                 'request_slots': {}) and changed to dict('intent': '', 'inform_slots': {},
+                                 'request_slots': {}, 'round': int, 'speaker': 'User')
+        """
+
+        current_informs = {}
+        for key, value in user_action[const.INFORM_SLOTS].items():
+            add_inform(self.db_helper, current_informs, key, value)
+        self.__set_informs(dialogue, current_informs)
+        round_num = self.dialogues['round_num'][dialogue] + 1
+        user_action.update({const.ROUND: int(round_num), const.SPEAKER_TYPE: const.USR_SPEAKER_VAL})
+        self.__record_action(dialogue, user_action)
+        self.dialogues['round_num'][dialogue] = round_num
+
+    def __set_informs(self, dialogue, informs):
+        """
+        Sets informs in the current informs of a dialogue.
+
+        Parameters:
+            dialogue (int): The index of the dialogue
+            informs (dict): The slots and their values
+        """
+
+        for key, value in informs.items():
+            slot = self.slots_dict[key]
+            self.dialogues['current_informs'][dialogue, slot] = value
+            self.dialogues['current_slots'][dialogue, slot] = True
+
+    def __record_action(self, dialogue, action):
+        """
+        Records the last action of a dialogue in the structured array, the previous one being shifted.
+
+        Parameters:
+            dialogue (int): The index of the dialogue
+            action (dict): The action of format dict('intent': '', 'inform_slots': {}, 'request_slots': {})
+        """
+
+        intent = self.dialogues['intent'][dialogue]
+        inform_slots = self.dialogues['inform_slots'][dialogue]
+        request_slots = self.dialogues['request_slots'][dialogue]
+
+        intent[1] = intent[0]
+        inform_slots[1] = inform_slots[0]
+        request_slots[1] = request_slots[0]
+
+        intent[0] = self.intents_dict[action[const.INTENT]]
+        inform_slots[0] = False
+        inform_slots[0, [self.slots_dict[key] for key in action[const.INFORM_SLOTS].keys()]] = True
+        request_slots[0] = False
+        request_slots[0, [self.slots_dict[key] for key in action[const.REQUEST_SLOTS].keys()]] = True
+
+        self.dialogues['num_actions'][dialogue] += 1
@@ -1,26 +1,44 @@
 import dialogue_system.dialogue_config as cfg
 import dialogue_system.constants as const
-from collections import defaultdict
+from dialogue_system.dm.dst.kb_index import popcount
+from dialogue_system.dm.dst.lru_cache import LRUCache
+from collections import Counter
+import pickle
 import copy
+import os
 
 
 class DBQuery:
     """Queries the database for the state tracker."""
 
-    def __init__(self, database):
+    def __init__(self, knowledge_base, cache_size=None):
         """
         The constructor for DBQuery.
 
         Parameters:
-            database (dict): The database in the format dict(long: dict)
+            knowledge_base (KnowledgeBase): The database in the format dict(long: dict) along with its index, None for
+                                            subclasses that query another storage
+            cache_size (int): The maximum number of constraint sets kept in each query cache, None for unbounded
         """
 
-        self.database = database
+        if knowledge_base is not None:
+            self.database = knowledge_base.database
+            self.index = knowledge_base.index
         self.no_query = cfg.no_query_keys
         self.match_key = cfg.usersim_default_key
 
-        self.cached_db_slot = defaultdict(dict)
-        self.cached_db = defaultdict(dict)
+        self.cached_db_slot = LRUCache(cache_size)
+        self.cached_db = LRUCache(cache_size)
+        self.cached_value_counts = LRUCache(cache_size)
+
+        self.reset()
+
+    def reset(self):
+        """Forgets the last query of the dialogue, called at the start of each episode."""
+
+        # The constraint items and the results of the last get_db_results, narrowed when constraints are added
+        self.last_items = None
+        self.last_results = None
 
     def fill_inform_slot(self, inform_slots_to_be_filled, current_slots):
         """
@@ -94,12 +112,10 @@ class DBQuery:
             ####################################################################
             #   Grab the value for the slot with the highest count and fill it
             ####################################################################
-            values_dict = self._count_slot_values(slot, kb_results)
-
-            values_counts = [(v, values_dict[v]) for v in values_dict.keys()]
-            if len(values_counts) > 0:
+            values_counts = self.get_slot_value_counts(slot, current_slots)
+            if values_counts:
                 if inform_slots_to_be_filled[slot] == "PLACEHOLDER":
-                    filled_in_slots[slot] = sorted(values_counts, key = lambda x: x[1], reverse=True)[0][0] # something wrong here
+                    filled_in_slots[slot] = values_counts.most_common(1)[0][0]
                 else:
                     filled_in_slots[slot] = inform_slots_to_be_filled[slot]
             else:
@@ -109,33 +125,87 @@ class DBQuery:
 
     def _count_slot_values(self, key, db_subdict):
         """
-        Return a dict of the different values and occurrences of each, given a key, from a sub-dict of database
+        Return a counter of the different values and occurrences of each, given a key, from a sub-dict of database
 
         Parameters:
             key (string): The key to be counted
             db_subdict (dict): A sub-dict of the database
 
         Returns:
-            dict: The values and their occurrences given the key
+            collections.Counter: The values and their occurrences given the key, in order of first occurrence
+        """
+
+        return Counter(item[key] for item in db_subdict.values() if key in item)
+
+    def get_slot_value_counts(self, key, constraints):
         """
+        Return the value counts of a key among the items in the database that fit the constraints.
 
-        slot_values = defaultdict(int)  # init to 0
-        for id in db_subdict.keys():
-            current_option_dict = db_subdict[id]
-            # If there is a match
-            if key in current_option_dict.keys():
-                slot_value = current_option_dict[key]
-                # This will add 1 to 0 if this is the first time this value has been encountered, or it will add 1
-                # to whatever was already in there
-                slot_values[slot_value] += 1
-        return slot_values
+        The counters are cached per constraint set and per key, so the top values can be taken with
+        Counter.most_common (an argmax or a partial selection) instead of counting and sorting them again.
+
+        Parameters:
+            key (string): The key to be counted
+            constraints (dict): The current informs
+
+        Returns:
+            collections.Counter: The values and their occurrences given the key, in order of first occurrence
+        """
+
+        inform_items = frozenset(self._query_constraints(constraints).items())
+        slot_counts = self.cached_value_counts.get(inform_items)
+        if slot_counts is None:
+            slot_counts = {}
+            self.cached_value_counts.put(inform_items, slot_counts)
+
+        if key not in slot_counts:
+            slot_counts[key] = self._count_values(key, constraints)
+        return slot_counts[key]
+
+    def _count_values(self, key, constraints):
+        """Counts the values of a key among the results of the constraints, on a value counts cache miss."""
+
+        return self._count_slot_values(key, self.get_db_results(constraints))
+
+    def intern_value(self, key, value):
+        """
+        Normalizes and interns the value of an inform as it enters the state tracker.
+
+        The code is memoized by the index, so the queries of the following turns only compare integer codes.
+
+        Parameters:
+            key (string): The slot of the inform
+            value (object): The value of the inform, in its surface form (which is kept for the NLG)
+
+        Returns:
+            int: The code of the (key, value) pair
+        """
+
+        return self.index.value_code(key, value)
+
+    def _query_constraints(self, constraints):
+        """
+        Return the constraints that are used to query the database.
+
+        Filter non-queryable items and keys with the value 'anything' since those are inconsequential to the
+        constraints.
+
+        Parameters:
+            constraints (dict): The current informs
+
+        Returns:
+            dict: The queryable constraints
+        """
+
+        return {k: v for k, v in constraints.items() if k not in self.no_query and v is not const.ANYTHING}
 
     def get_db_results(self, constraints):
         """
         Get all items in the database that fit the current constraints.
 
-        Looks at each item in the database and if its slots contain all constraints and their values match then the item
-        is added to the return dict.
+        Intersects the posting lists of the constraints in the inverted index, so an item is added to the return dict
+        only if its slots contain all constraints and their values match. If the constraints only add to the ones of the
+        last query of the dialogue, then the last results are narrowed instead of querying the whole database.
 
         Parameters:
             constraints (dict): The current informs
@@ -144,49 +214,56 @@ class DBQuery:
             dict: The available items in the database
         """
 
-        # Filter non-queryable items and keys with the value 'anything' since those are
-        # inconsequential to the constraints
-        new_constraints = {k: v for k, v in constraints.items() if k not in self.no_query and v is not const.ANYTHING}
+        new_constraints = self._query_constraints(constraints)
 
         inform_items = frozenset(new_constraints.items())
-        cache_return = self.cached_db[inform_items]
+        cache_return = self.cached_db.get(inform_items)
 
-        if cache_return is None:
-            # If it is none then no matches fit with the constraints so return an empty dict
-            return {}
-        # if it isnt empty then return what it is
-        if cache_return:
+        # If it is cached then return what it is (an empty dict if no matches fit with the constraints)
+        if cache_return is not None:
+            self.last_items, self.last_results = inform_items, cache_return
             return cache_return
         # else continue on
 
-        available_options = {}
-        for id in self.database.keys():
-            current_option_dict = self.database[id]
-            # First check if that database item actually contains the inform keys
-            # Note: this assumes that if a constraint is not found in the db item then that item is not a match
-            if len(set(new_constraints.keys()) - set(self.database[id].keys())) == 0:
-                match = True
-                # Now check all the constraint values against the db values and if there is a mismatch don't store
-                for k, v in new_constraints.items():
-                    if str(v).lower() != str(current_option_dict[k]).lower():
-                        match = False
-                if match:
-                    # Update cache
-                    self.cached_db[inform_items].update({id: current_option_dict})
-                    available_options.update({id: current_option_dict})
-
-        # if nothing available then set the set of constraint items to none in cache
-        if not available_options:
-            self.cached_db[inform_items] = None
+        available_options = self._query_database(new_constraints, inform_items)
+
+        # Update cache
+        self.cached_db.put(inform_items, available_options)
+        self.last_items, self.last_results = inform_items, available_options
+
+        return available_options
+
+    def _query_database(self, new_constraints, inform_items):
+        """
+        Queries the database for the items that fit the queryable constraints, on a cache miss.
+
+        Parameters:
+            new_constraints (dict): The queryable constraints
+            inform_items (frozenset): The items of the queryable constraints
+
+        Returns:
+            dict: The available items in the database
+        """
 
+        if self.last_items is not None and self.last_items <= inform_items:
+            # Constraints were only added since the last query of the dialogue, so narrow its results
+            added_constraints = dict(inform_items - self.last_items)
+            ids = self.index.refine(self.last_results.keys(), self.index.value_codes(added_constraints))
+        else:
+            # A constraint was removed or changed (or it is the first query), so query the whole database
+            ids = self.index.match(self.index.value_codes(new_constraints))
+
+        available_options = {}
+        for id in ids:
+            available_options[id] = self.database[id]
         return available_options
 
     def get_db_results_for_slots(self, current_informs):
         """
         Counts occurrences of each current inform slot (key and value) in the database items.
 
-        For each item in the database and each current inform slot if that slot is in the database item (matches key
-        and value) then increment the count for that key by 1.
+        For each current inform slot the count is the popcount of the bit-vector of its (key, value) pair in the index,
+        and the count of items matching all constraints is the popcount of the AND of those bit-vectors.
 
         Parameters:
             current_informs (dict): The current informs/constraints
@@ -198,57 +275,129 @@ class DBQuery:
         # The items (key, value) of the current informs are used as a key to the cached_db_slot
         inform_items = frozenset(current_informs.items())
         # A dict of the inform keys and their counts as stored (or not stored) in the cached_db_slot
-        cache_return = self.cached_db_slot[inform_items]
+        cache_return = self.cached_db_slot.get(inform_items)
 
-        if cache_return:
+        if cache_return is not None:
             return cache_return
 
         # If it made it down here then a new query was made and it must add it to cached_db_slot and return it
+        db_results = self._count_database(current_informs)
+
+        # update cache
+        self.cached_db_slot.put(inform_items, db_results)
+        return db_results
+
+    def _count_database(self, current_informs):
+        """
+        Counts the matches of each current inform slot and of all of them, on a cache miss.
+
+        Parameters:
+            current_informs (dict): The current informs/constraints
+
+        Returns:
+            dict: Each key in current_informs with the count of the number of matches for that key
+        """
+
         # Init all key values with 0
         db_results = {key: 0 for key in current_informs.keys()}
         db_results[const.KB_MATCHING_ALL_CONSTRAINTS] = 0
 
-        for id in self.database.keys():
-            all_slots_match = True
-            for CI_key, CI_value in current_informs.items():
-                # Skip if a no query item and all_slots_match stays true
-                if CI_key in self.no_query:
-                    continue
-                # If anything all_slots_match stays true AND the specific key slot gets a +1
-                if CI_value == const.ANYTHING:
-                    db_results[CI_key] += 1
-                    continue
-                if CI_key in self.database[id].keys():
-                    if CI_value.lower() == self.database[id][CI_key].lower():
-                        db_results[CI_key] += 1
-                    else:
-                        all_slots_match = False
-                else:
-                    all_slots_match = False
-            if all_slots_match:
-                db_results[const.KB_MATCHING_ALL_CONSTRAINTS] += 1
+        # The items matching all constraints are the AND of the bit-vectors of every constraint
+        all_slots_bits = None
+        for CI_key, CI_value in current_informs.items():
+            # Skip if a no query item, it matches all items and its count stays 0
+            if CI_key in self.no_query:
+                continue
+            # If anything it matches all items AND the specific key slot gets the whole database count
+            if CI_value == const.ANYTHING:
+                db_results[CI_key] = self.index.size
+                continue
+            slot_bits = self.index.bitmap(self.index.value_code(CI_key, CI_value))
+            db_results[CI_key] = popcount(slot_bits)
+            all_slots_bits = slot_bits if all_slots_bits is None else all_slots_bits & slot_bits
+
+        if all_slots_bits is None:
+            db_results[const.KB_MATCHING_ALL_CONSTRAINTS] = self.index.size
+        else:
+            db_results[const.KB_MATCHING_ALL_CONSTRAINTS] = popcount(all_slots_bits)
 
-        # update cache (set the empty dict)
-        self.cached_db_slot[inform_items].update(db_results)
-        assert self.cached_db_slot[inform_items] == db_results
         return db_results
 
-    def suggest_slot_values(self, request_slots, current_slots):
-        """ Return the suggest slot values """
+    def cache_stats(self):
+        """
+        Returns the statistics of the query caches.
+
+        Returns:
+            dict: The size, capacity, hits, misses, evictions and hit rate of the db, db slot and value counts caches
+        """
+
+        return {'db': self.cached_db.stats(), 'db_slot': self.cached_db_slot.stats(),
+                'value_counts': self.cached_value_counts.stats()}
 
-        avail_kb_results = self.get_db_results(current_slots)
+    def load_cache(self, path, fingerprint):
+        """
+        Loads the query caches saved by a previous run, to skip their warmup.
 
+        The results of get_db_results are stored as ids and rebuilt from the database, so they share its items.
+
+        Parameters:
+            path (str): The path of the persistent cache file
+            fingerprint (str): The fingerprint of the KB file, the cache is ignored if it was saved for another one
+
+        Returns:
+            bool: True if the cache was loaded, False if there is no cache file or it is stale
+        """
+
+        if not os.path.exists(path):
+            return False
+        payload = pickle.load(open(path, 'rb'))
+        if payload['fingerprint'] != fingerprint:
+            return False
+
+        for inform_items, ids in payload['db']:
+            self.cached_db.put(inform_items, self._load_items(ids))
+        for inform_items, db_results in payload['db_slot']:
+            self.cached_db_slot.put(inform_items, db_results)
+        return True
+
+    def save_cache(self, path, fingerprint):
+        """
+        Saves the query caches, to be loaded by the next runs on the same KB.
+
+        Parameters:
+            path (str): The path of the persistent cache file
+            fingerprint (str): The fingerprint of the KB file
+        """
+
+        if os.path.split(path)[0] and not os.path.exists(os.path.split(path)[0]):
+            os.makedirs(os.path.split(path)[0])
+
+        payload = {'fingerprint': fingerprint,
+                   'db': [(inform_items, list(results.keys())) for inform_items, results in self.cached_db.items()],
+                   'db_slot': self.cached_db_slot.items()}
+        pickle.dump(payload, open(path, 'wb'), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _load_items(self, ids):
+        """Returns the available items dict of a list of ids, as returned by get_db_results."""
+
+        return {id: self.database[id] for id in ids}
+
+    def suggest_slot_values(self, request_slots, current_slots, top_k=None):
+        """
+        Return the suggested values of each request slot, ordered by their count among the available items.
+
+        Parameters:
+            request_slots (dict): The request slots to suggest values for
+            current_slots (dict): The current informs/constraints
+            top_k (int): The maximum number of values suggested per slot, None for all of them. Default: None
+
+        Returns:
+            dict: Each key in request_slots with the list of its suggested values
+        """
 
         return_suggest_slot_vals = {}
         for slot in request_slots.keys():
-            avail_values_dict = self._count_slot_values(slot, avail_kb_results)
-            values_counts = [(v, avail_values_dict[v]) for v in avail_values_dict.keys()]
-
-            if len(values_counts) > 0:
-                return_suggest_slot_vals[slot] = []
-                sorted_dict = sorted(values_counts, key = lambda x: -x[1])
-                for k in sorted_dict: return_suggest_slot_vals[slot].append(k[0])
-            else:
-                return_suggest_slot_vals[slot] = []
+            avail_values_counts = self.get_slot_value_counts(slot, current_slots)
+            return_suggest_slot_vals[slot] = [value for value, _ in avail_values_counts.most_common(top_k)]
 
         return return_suggest_slot_vals
@@ -0,0 +1,82 @@
+import dialogue_system.constants as const
+import numpy as np
+
+
+class DialogueHistory:
+    """
+    The history of the actions of a dialogue, keeping only the encoded form of the last actions in a ring buffer.
+
+    An action is encoded as its intent index and the bags of its inform and request slots. The full action dicts are
+    only kept if asked for (e.g. for tracing the dialogue).
+    """
+
+    def __init__(self, intents_dict, slots_dict, size=2, keep_actions=False):
+        """
+        The constructor for DialogueHistory.
+
+        Parameters:
+            intents_dict (dict): The index of each intent
+            slots_dict (dict): The index of each slot
+            size (int): The number of last actions kept encoded, at least 2 (the last user and agent actions).
+                        Default: 2
+            keep_actions (bool): Keeps the full action dicts too. Default: False
+        """
+
+        if size < 2:
+            raise ValueError('History size must be at least 2!')
+
+        self.intents_dict = intents_dict
+        self.slots_dict = slots_dict
+        self.size = size
+        self.keep_actions = keep_actions
+
+        self.intents = np.full(size, -1, dtype=np.int32)
+        self.inform_slots = np.zeros((size, len(slots_dict)), dtype=np.bool_)
+        self.request_slots = np.zeros((size, len(slots_dict)), dtype=np.bool_)
+        self.reset()
+
+    def reset(self):
+        """Empties the history."""
+
+        # The number of actions appended since the reset, the ring buffer keeps the last size ones
+        self.length = 0
+        self.actions = [] if self.keep_actions else None
+
+    def append(self, action):
+        """
+        Appends an action to the history, encoding it in the ring buffer.
+
+        Parameters:
+            action (dict): The action of format dict('intent': '', 'inform_slots': {}, 'request_slots': {})
+        """
+
+        row = self.length % self.size
+        self.intents[row] = self.intents_dict[action[const.INTENT]]
+        self.inform_slots[row] = False
+        self.inform_slots[row, [self.slots_dict[key] for key in action[const.INFORM_SLOTS].keys()]] = True
+        self.request_slots[row] = False
+        self.request_slots[row, [self.slots_dict[key] for key in action[const.REQUEST_SLOTS].keys()]] = True
+        self.length += 1
+
+        if self.keep_actions:
+            self.actions.append(action)
+
+    def row(self, back=1):
+        """
+        Returns the row of the ring buffer of the back-th last action (1 for the last one).
+
+        Parameters:
+            back (int): The position of the action from the end of the history, at most the history size. Default: 1
+
+        Returns:
+            int: The row of the action, None if the history has less than back actions
+        """
+
+        if back > self.size:
+            raise IndexError(f'Only the last {self.size} actions are kept')
+        if back > self.length:
+            return None
+        return (self.length - back) % self.size
+
+    def __len__(self):
+        return self.length
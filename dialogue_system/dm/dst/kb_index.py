@@ -0,0 +1,227 @@
+from collections import defaultdict
+import numpy as np
+
+
+# Code of a (slot, value) pair that no item of the database has
+UNKNOWN_CODE = -1
+# Number of set bits of every possible byte, used to popcount the packed bit-vectors
+_POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def normalize_value(value):
+    """
+    Returns the normalized form of a slot value, the one used to compare constraints against the database.
+
+    Parameters:
+        value (object): A slot value, from the database or from a constraint
+
+    Returns:
+        str: The lower-cased string form of the value
+    """
+
+    return str(value).lower()
+
+
+def popcount(bits):
+    """
+    Returns the number of set bits of a packed bit-vector.
+
+    Parameters:
+        bits (numpy.array): A bit-vector packed with numpy.packbits
+
+    Returns:
+        int: The number of items flagged in the bit-vector
+    """
+
+    return int(_POPCOUNT_TABLE[bits].sum())
+
+
+def build_bitmap(size, positions):
+    """
+    Builds the packed bit-vector of a list of item positions, setting its bits directly in the packed bytes.
+
+    Parameters:
+        size (int): The number of items in the database
+        positions (list): The positions of the items whose bits are set
+
+    Returns:
+        numpy.array: The packed bit-vector, of shape (ceil(size / 8),), as numpy.packbits gives it
+    """
+
+    bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+    positions = np.asarray(positions, dtype=np.int64)
+    np.bitwise_or.at(bits, positions >> 3, (0x80 >> (positions & 7)).astype(np.uint8))
+    return bits
+
+
+def build_bitmaps(size, positions_lists, out=None):
+    """
+    Builds the packed bit-vectors of lists of item positions, one row at a time.
+
+    Parameters:
+        size (int): The number of items in the database
+        positions_lists (list): For each bit-vector, the positions of the items whose bits are set
+        out (numpy.array): The uint8 matrix the rows are written to, e.g. a memory-mapped file. Default: None (a new
+                           matrix)
+
+    Returns:
+        numpy.array: A matrix of shape (number of lists, ceil(size / 8)), one packed bit-vector per row
+    """
+
+    if out is None:
+        out = np.zeros((len(positions_lists), (size + 7) // 8), dtype=np.uint8)
+    for row, positions in enumerate(positions_lists):
+        out[row] = build_bitmap(size, positions)
+    return out
+
+
+class KBIndex:
+    """
+    Inverted index over the database, mapping each normalized (slot, value) pair to the ids of the items with it.
+
+    Every normalized (slot, value) pair of the database is interned as an integer code (the row of its bit-vector), so
+    the queries compare and look up codes instead of lower-casing strings.
+    """
+
+    def __init__(self, database):
+        """
+        The constructor for KBIndex.
+
+        Walks the database once (or reads the prebuilt index of a compiled knowledge base) and builds the posting lists
+        of every (slot, value) pair found in its items. The packed bit-vector of a pair (one bit per item, in the
+        database order) used to count matches is only built when the pair is first counted, so the pairs that are
+        never queried (e.g. of the no query slots) take no memory.
+
+        Parameters:
+            database (dict or CompiledDatabase): The database in the format dict(long: dict)
+        """
+
+        self.database = database
+        self.size = len(database)
+        # Memo of the codes of the (slot, value) pairs as they are informed, so each one is normalized only once
+        self.codes = {}
+
+        # A compiled knowledge base ships its index: the bit-vectors are memory-mapped and the posting lists are only
+        # converted to sets of ids on their first use
+        if getattr(database, 'index_keys', None) is not None:
+            self.order = database.positions
+            self.pairs = {pair: code for code, pair in enumerate(database.index_keys)}
+            self.index_bitmaps = database.index_bitmaps
+            self.postings = [None] * len(self.pairs)
+        else:
+            # Position of each id in the database, used to return the results in the same order as a linear scan
+            self.order = {id: position for position, id in enumerate(database.keys())}
+            postings = defaultdict(set)
+            for id, item in database.items():
+                for slot, value in item.items():
+                    postings[(slot, normalize_value(value))].add(id)
+            self.pairs = {pair: code for code, pair in enumerate(postings.keys())}
+            self.postings = list(postings.values())
+            self.index_bitmaps = None
+            # Memo of the bit-vectors built so far, by code
+            self.bitmaps = {}
+        self.empty_bits = build_bitmap(self.size, [])
+
+    def value_code(self, slot, value):
+        """
+        Returns the integer code of a (slot, value) pair, normalizing the value only the first time it is seen.
+
+        Parameters:
+            slot (str): The slot of the constraint
+            value (object): The value of the constraint, in any surface form
+
+        Returns:
+            int: The code of the normalized pair, UNKNOWN_CODE if no item of the database has it
+        """
+
+        key = (slot, value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.pairs.get((slot, normalize_value(value)), UNKNOWN_CODE)
+            self.codes[key] = code
+        return code
+
+    def value_codes(self, constraints):
+        """Returns the codes of the (slot, value) pairs of the constraints."""
+
+        return [self.value_code(slot, value) for slot, value in constraints.items()]
+
+    def posting(self, code):
+        """
+        Returns the posting list of a (slot, value) pair.
+
+        Parameters:
+            code (int): The code of the pair
+
+        Returns:
+            set: The ids of the items whose slot matches the value, empty if there is none
+        """
+
+        if code == UNKNOWN_CODE:
+            return set()
+        posting = self.postings[code]
+        if posting is None:
+            posting = set(self.database.posting_ids(code))
+            self.postings[code] = posting
+        return posting
+
+    def match(self, codes):
+        """
+        Returns the ids of the items that contain all constraints with matching values.
+
+        Intersects the posting lists of the constraints, starting from the smallest one.
+
+        Parameters:
+            codes (list): The codes of the constraints, already filtered of the non-queryable keys
+
+        Returns:
+            list: The matching ids, in the database order
+        """
+
+        if not codes:
+            return list(self.database.keys())
+
+        # A pair that is not in the index cannot be matched by any item
+        if UNKNOWN_CODE in codes:
+            return []
+        postings = sorted((self.posting(code) for code in codes), key=len)
+
+        ids = postings[0].intersection(*postings[1:])
+        return sorted(ids, key=self.order.__getitem__)
+
+    def refine(self, ids, codes):
+        """
+        Narrows a list of candidate ids to the ones that also match the given constraints.
+
+        Parameters:
+            ids (iterable): The candidate ids, in the database order
+            codes (list): The codes of the constraints to be added, already filtered of the non-queryable keys
+
+        Returns:
+            list: The candidate ids that match the constraints, keeping their order
+        """
+
+        postings = [self.posting(code) for code in codes]
+        return [id for id in ids if all(id in posting for posting in postings)]
+
+    def bitmap(self, code):
+        """
+        Returns the packed bit-vector of the items whose slot matches the value, building it on its first use.
+
+        Parameters:
+            code (int): The code of the (slot, value) pair
+
+        Returns:
+            numpy.array: The packed bit-vector, the empty one if no item matches
+        """
+
+        if code == UNKNOWN_CODE:
+            return self.empty_bits
+        if self.index_bitmaps is not None:
+            return self.index_bitmaps[code]
+
+        bits = self.bitmaps.get(code)
+        if bits is None:
+            bits = build_bitmap(self.size, [self.order[id] for id in self.postings[code]])
+            self.bitmaps[code] = bits
+        return bits
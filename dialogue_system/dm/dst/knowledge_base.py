@@ -0,0 +1,229 @@
+from collections.abc import Mapping
+from dialogue_system.dm.dst.kb_index import KBIndex, normalize_value, build_bitmaps
+from utils.util import remove_empty_slots
+from types import MappingProxyType
+import numpy as np
+import threading
+import hashlib
+import json
+import os
+import pickle
+
+
+# Version of the compiled knowledge base format, bumped whenever the layout of the files changes
+COMPILED_KB_VERSION = 1
+# Code of a slot missing from an item in the integer-encoded columns
+MISSING_VALUE = -1
+
+
+# Registry of the knowledge bases already loaded by the process, by absolute path
+_knowledge_bases = {}
+_knowledge_bases_lock = threading.Lock()
+
+
+def get_knowledge_base(path):
+    """
+    Returns the knowledge base of a database path, loading it and building its index only on the first call.
+
+    Every component asking for the same path (state tracker, user simulator, ...) shares the same instance.
+
+    Parameters:
+        path (str): The path of the .p file or of the compiled knowledge base directory
+
+    Returns:
+        KnowledgeBase: The shared knowledge base
+    """
+
+    key = os.path.abspath(path)
+    with _knowledge_bases_lock:
+        if key not in _knowledge_bases:
+            _knowledge_bases[key] = KnowledgeBase(path)
+        return _knowledge_bases[key]
+
+
+class KnowledgeBase:
+    """A database loaded once along with its index, shared read-only by the components of the dialogue system."""
+
+    def __init__(self, path):
+        """
+        The constructor for KnowledgeBase.
+
+        Prefer get_knowledge_base, which returns the instance already loaded for the path if any.
+
+        Parameters:
+            path (str): The path of the .p file or of the compiled knowledge base directory
+        """
+
+        self.path = path
+        database = load_database(path)
+        # The items are shared by every component, so they must not be mutated (copy them before changing them)
+        self.database = database if isinstance(database, CompiledDatabase) else MappingProxyType(database)
+        self.index = KBIndex(self.database)
+
+
+def database_fingerprint(path):
+    """
+    Returns a hash of the content of a database, used to invalidate what was computed from another version of it.
+
+    Parameters:
+        path (str): The path of the .p file or of the compiled knowledge base directory
+
+    Returns:
+        str: The SHA-1 hex digest of the file, or of all the files of the directory
+    """
+
+    if os.path.isdir(path):
+        file_paths = [os.path.join(path, file_name) for file_name in sorted(os.listdir(path))]
+    else:
+        file_paths = [path]
+
+    digest = hashlib.sha1()
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_compiled_database(path):
+    """Returns true if the path is a compiled knowledge base directory."""
+
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def load_database(path):
+    """
+    Loads the database, either from a pickled dict or from a compiled knowledge base.
+
+    Parameters:
+        path (str): The path of the .p file or of the compiled knowledge base directory
+
+    Returns:
+        dict or CompiledDatabase: The database in the format dict(long: dict), with the empty slots removed
+    """
+
+    if is_compiled_database(path):
+        return CompiledDatabase(path)
+
+    # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
+    database = pickle.load(open(path, 'rb'), encoding='latin1')
+
+    # Clean DB
+    remove_empty_slots(database)
+    return database
+
+
+def compile_database(database, path):
+    """
+    Compiles a database into the columnar knowledge base format.
+
+    The compiled knowledge base is a directory with:
+        meta.json: the slots, the string dictionary (values of each slot) and the keys of the prebuilt index
+        ids.npy: the ids of the items, in the database order
+        columns.npy: the items as integer-encoded columns, one per slot, MISSING_VALUE if the item has no such slot
+        index_offsets.npy, index_positions.npy: the posting lists of the index keys, as positions of the items
+        index_bitmaps.npy: the packed bit-vectors of the index keys, one per row
+
+    Parameters:
+        database (dict): The database in the format dict(long: dict), with the empty slots removed
+        path (str): The path of the compiled knowledge base directory
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    slots = []
+    values = {}
+    value_codes = {}
+    for item in database.values():
+        for slot, value in item.items():
+            if slot not in value_codes:
+                slots.append(slot)
+                values[slot] = []
+                value_codes[slot] = {}
+            if value not in value_codes[slot]:
+                value_codes[slot][value] = len(values[slot])
+                values[slot].append(value)
+
+    ids = np.array(list(database.keys()), dtype=np.int64)
+    columns = np.full((len(ids), len(slots)), MISSING_VALUE, dtype=np.int32)
+    postings = {}
+    for position, item in enumerate(database.values()):
+        for column, slot in enumerate(slots):
+            if slot in item:
+                columns[position, column] = value_codes[slot][item[slot]]
+                postings.setdefault((slot, normalize_value(item[slot])), []).append(position)
+
+    index_keys = list(postings.keys())
+    index_offsets = np.zeros(len(index_keys) + 1, dtype=np.int64)
+    index_offsets[1:] = np.cumsum([len(postings[key]) for key in index_keys])
+    index_positions = np.array([p for key in index_keys for p in postings[key]], dtype=np.int32)
+
+    np.save(os.path.join(path, 'ids.npy'), ids)
+    np.save(os.path.join(path, 'columns.npy'), columns)
+    np.save(os.path.join(path, 'index_offsets.npy'), index_offsets)
+    np.save(os.path.join(path, 'index_positions.npy'), index_positions)
+    # The bit-vectors are written to the file row by row, without holding them all in memory
+    index_bitmaps = np.lib.format.open_memmap(os.path.join(path, 'index_bitmaps.npy'), mode='w+', dtype=np.uint8,
+                                              shape=(len(index_keys), (len(ids) + 7) // 8))
+    build_bitmaps(len(ids), [postings[key] for key in index_keys], out=index_bitmaps)
+    index_bitmaps.flush()
+    del index_bitmaps
+    meta = {'version': COMPILED_KB_VERSION, 'slots': slots, 'values': values, 'index': index_keys}
+    json.dump(meta, open(os.path.join(path, 'meta.json'), 'w'))
+
+
+class CompiledDatabase(Mapping):
+    """Read-only database backed by a compiled knowledge base, with its arrays memory-mapped."""
+
+    def __init__(self, path):
+        """
+        The constructor for CompiledDatabase.
+
+        Parameters:
+            path (str): The path of the compiled knowledge base directory
+        """
+
+        meta = json.load(open(os.path.join(path, 'meta.json')))
+        if meta['version'] != COMPILED_KB_VERSION:
+            raise ValueError(f"Compiled KB version {meta['version']} is not supported, recompile {path}")
+
+        self.path = path
+        self.slots = meta['slots']
+        self.values = [meta['values'][slot] for slot in self.slots]
+        self.index_keys = [tuple(key) for key in meta['index']]
+
+        self.ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode='r')
+        self.columns = np.load(os.path.join(path, 'columns.npy'), mmap_mode='r')
+        self.index_offsets = np.load(os.path.join(path, 'index_offsets.npy'), mmap_mode='r')
+        self.index_positions = np.load(os.path.join(path, 'index_positions.npy'), mmap_mode='r')
+        self.index_bitmaps = np.load(os.path.join(path, 'index_bitmaps.npy'), mmap_mode='r')
+
+        self.positions = {id: position for position, id in enumerate(self.ids.tolist())}
+
+    def posting_ids(self, key_index):
+        """
+        Returns the posting list of a key of the prebuilt index.
+
+        Parameters:
+            key_index (int): The position of the normalized (slot, value) pair in index_keys
+
+        Returns:
+            list: The ids of the items that have the pair
+        """
+
+        positions = self.index_positions[self.index_offsets[key_index]:self.index_offsets[key_index + 1]]
+        return self.ids[positions].tolist()
+
+    def __getitem__(self, id):
+        row = self.columns[self.positions[id]].tolist()
+        return {slot: self.values[column][code] for column, (slot, code) in enumerate(zip(self.slots, row))
+                if code != MISSING_VALUE}
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, id):
+        return id in self.positions
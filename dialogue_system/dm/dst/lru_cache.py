@@ -0,0 +1,88 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A size-bounded cache that evicts the least recently used entry, and counts its hits, misses and evictions."""
+
+    def __init__(self, capacity=None):
+        """
+        The constructor for LRUCache.
+
+        Parameters:
+            capacity (int): The maximum number of entries kept in the cache, None for an unbounded cache
+        """
+
+        if capacity is not None and capacity <= 0:
+            raise ValueError('Cache capacity must be positive!')
+
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Returns the value cached for the key and marks it as the most recently used one.
+
+        Unlike a defaultdict, a lookup never inserts an entry.
+
+        Parameters:
+            key (hashable): The key of the entry
+            default (object): The value returned on a miss. Default: None
+
+        Returns:
+            object: The cached value, or default if the key is not cached
+        """
+
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Caches the value for the key, evicting the least recently used entry if the cache is full.
+
+        Parameters:
+            key (hashable): The key of the entry
+            value (object): The value to be cached
+        """
+
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if self.capacity is not None and len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def items(self):
+        """Returns the cached (key, value) pairs, from the least to the most recently used, without counting lookups."""
+
+        return list(self.entries.items())
+
+    def clear(self):
+        """Removes all entries, the statistics are kept."""
+
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the statistics of the cache.
+
+        Returns:
+            dict: The size, capacity, hits, misses, evictions and hit rate of the cache
+        """
+
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
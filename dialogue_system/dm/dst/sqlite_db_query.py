@@ -0,0 +1,228 @@
+from dialogue_system.dm.dst.db_query import DBQuery
+from dialogue_system.dm.dst.kb_index import normalize_value
+from dialogue_system.dm.dst.knowledge_base import load_database
+import dialogue_system.constants as const
+from collections import Counter
+import sqlite3
+import sys
+import os
+
+
+def _column(slot):
+    """Returns the quoted SQL column of the values of a slot."""
+
+    return '"{}"'.format(slot.replace('"', '""'))
+
+
+def _norm_column(slot):
+    """Returns the quoted SQL column of the normalized values of a slot, the one the constraints are compared to."""
+
+    return '"norm_{}"'.format(slot.replace('"', '""'))
+
+
+def build_sqlite_database(database, path):
+    """
+    Stores a database in a SQLite file, with an index on the normalized values of every slot.
+
+    The items are stored in a single table, with the id, the position of the item in the database order, and two
+    columns per slot: the original value (NULL if the item has no such slot) and its normalized value.
+
+    Parameters:
+        database (dict): The database in the format dict(long: dict), with the empty slots removed
+        path (str): The path of the SQLite file, overwritten if it exists
+    """
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    slots = []
+    for item in database.values():
+        for slot in item.keys():
+            if slot not in slots:
+                slots.append(slot)
+
+    connection = sqlite3.connect(path)
+    with connection:
+        columns = ', '.join(f'{_column(slot)} TEXT, {_norm_column(slot)} TEXT' for slot in slots)
+        connection.execute(f'CREATE TABLE items (id INTEGER PRIMARY KEY, position INTEGER NOT NULL, {columns})')
+        connection.execute('CREATE TABLE slots (slot TEXT NOT NULL, position INTEGER NOT NULL)')
+        connection.executemany('INSERT INTO slots VALUES (?, ?)', [(slot, i) for i, slot in enumerate(slots)])
+
+        placeholders = ', '.join(['?'] * (2 + 2 * len(slots)))
+        rows = []
+        for position, (id, item) in enumerate(database.items()):
+            row = [id, position]
+            for slot in slots:
+                value = item.get(slot)
+                row += [value, None if value is None else normalize_value(value)]
+            rows.append(row)
+        connection.executemany(f'INSERT INTO items VALUES ({placeholders})', rows)
+
+        connection.execute('CREATE INDEX items_position ON items (position)')
+        for i, slot in enumerate(slots):
+            connection.execute(f'CREATE INDEX items_slot_{i} ON items ({_norm_column(slot)})')
+    connection.close()
+
+
+class SQLiteDBQuery(DBQuery):
+    """Queries a database stored in a SQLite file for the state tracker, for catalogs too large to be kept in memory."""
+
+    def __init__(self, sqlite_path, database_path=None, cache_size=None):
+        """
+        The constructor for SQLiteDBQuery.
+
+        Parameters:
+            sqlite_path (str): The path of the SQLite file of the database
+            database_path (str): The path of the database (pickled or compiled) to build the SQLite file from, if it
+                                 does not exist yet. Default: None
+            cache_size (int): The maximum number of constraint sets kept in each query cache, None for unbounded
+        """
+
+        if not os.path.exists(sqlite_path):
+            if database_path is None:
+                raise FileNotFoundError(f'No SQLite database in {sqlite_path} and no database to build it from')
+            build_sqlite_database(load_database(database_path), sqlite_path)
+
+        self.connection = sqlite3.connect(sqlite_path)
+        self.slots = [slot for slot, in self.connection.execute('SELECT slot FROM slots ORDER BY position')]
+        self.size = self.connection.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        # Memo of the normalized values of the (slot, value) pairs as they are informed
+        self.normalized_values = {}
+
+        super().__init__(None, cache_size)
+
+    def _where(self, constraints):
+        """
+        Returns the WHERE clause and its parameters matching all constraints, None if a constraint cannot match.
+
+        Parameters:
+            constraints (dict): The queryable constraints
+
+        Returns:
+            tuple: The WHERE clause (empty if no constraints) and the list of its parameters
+        """
+
+        if any(slot not in self.slots for slot in constraints.keys()):
+            return None
+        if not constraints:
+            return '', []
+        clause = ' AND '.join(f'{_norm_column(slot)} = ?' for slot in constraints.keys())
+        return f'WHERE {clause}', [self.intern_value(slot, value) for slot, value in constraints.items()]
+
+    def intern_value(self, key, value):
+        """
+        Normalizes and interns the value of an inform as it enters the state tracker.
+
+        Parameters:
+            key (string): The slot of the inform
+            value (object): The value of the inform, in its surface form
+
+        Returns:
+            str: The normalized value, the one compared to the normalized columns
+        """
+
+        normalized = self.normalized_values.get((key, value))
+        if normalized is None:
+            normalized = sys.intern(normalize_value(value))
+            self.normalized_values[(key, value)] = normalized
+        return normalized
+
+    def _query_database(self, new_constraints, inform_items):
+        """
+        Queries the SQLite file for the items that fit the queryable constraints, on a cache miss.
+
+        Parameters:
+            new_constraints (dict): The queryable constraints
+            inform_items (frozenset): The items of the queryable constraints
+
+        Returns:
+            dict: The available items in the database, in the database order
+        """
+
+        where = self._where(new_constraints)
+        if where is None:
+            return {}
+
+        columns = ', '.join(_column(slot) for slot in self.slots)
+        cursor = self.connection.execute(f'SELECT id, {columns} FROM items {where[0]} ORDER BY position', where[1])
+
+        available_options = {}
+        for id, *values in cursor:
+            available_options[id] = {slot: value for slot, value in zip(self.slots, values) if value is not None}
+        return available_options
+
+    def _load_items(self, ids):
+        """Returns the available items dict of a list of ids, as returned by get_db_results."""
+
+        columns = ', '.join(_column(slot) for slot in self.slots)
+        items = {}
+        # Query by chunks, to stay below the SQLite limit of parameters per statement
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join(['?'] * len(chunk))
+            cursor = self.connection.execute(f'SELECT id, {columns} FROM items WHERE id IN ({placeholders})', chunk)
+            for id, *values in cursor:
+                items[id] = {slot: value for slot, value in zip(self.slots, values) if value is not None}
+
+        # The ids were saved in the database order
+        return {id: items[id] for id in ids}
+
+    def _count_matches(self, constraints):
+        """Returns the number of items that fit the queryable constraints."""
+
+        where = self._where(constraints)
+        if where is None:
+            return 0
+        return self.connection.execute(f'SELECT COUNT(*) FROM items {where[0]}', where[1]).fetchone()[0]
+
+    def _count_database(self, current_informs):
+        """
+        Counts the matches of each current inform slot and of all of them with SQL, on a cache miss.
+
+        Parameters:
+            current_informs (dict): The current informs/constraints
+
+        Returns:
+            dict: Each key in current_informs with the count of the number of matches for that key
+        """
+
+        # Init all key values with 0
+        db_results = {key: 0 for key in current_informs.keys()}
+        db_results[const.KB_MATCHING_ALL_CONSTRAINTS] = 0
+
+        all_constraints = {}
+        for CI_key, CI_value in current_informs.items():
+            # Skip if a no query item, it matches all items and its count stays 0
+            if CI_key in self.no_query:
+                continue
+            # If anything it matches all items AND the specific key slot gets the whole database count
+            if CI_value == const.ANYTHING:
+                db_results[CI_key] = self.size
+                continue
+            db_results[CI_key] = self._count_matches({CI_key: CI_value})
+            all_constraints[CI_key] = CI_value
+
+        db_results[const.KB_MATCHING_ALL_CONSTRAINTS] = self._count_matches(all_constraints)
+        return db_results
+
+    def _count_values(self, key, constraints):
+        """
+        Counts the values of a key among the results of the constraints with SQL, on a value counts cache miss.
+
+        Parameters:
+            key (string): The key to be counted
+            constraints (dict): The current informs
+
+        Returns:
+            collections.Counter: The values and their occurrences given the key, in order of first occurrence
+        """
+
+        where = self._where(self._query_constraints(constraints))
+        if where is None or key not in self.slots:
+            return Counter()
+
+        clause = f'{where[0]} AND' if where[0] else 'WHERE'
+        cursor = self.connection.execute(
+            f'SELECT {_column(key)}, COUNT(*) FROM items {clause} {_column(key)} IS NOT NULL '
+            f'GROUP BY {_column(key)} ORDER BY MIN(position)', where[1])
+        return Counter(dict(cursor.fetchall()))
@@ -0,0 +1,205 @@
+import dialogue_system.constants as const
+import numpy as np
+
+
+class StateEncoder:
+    """Encodes the state representation into one preallocated float32 buffer, split in fixed segments."""
+
+    def __init__(self, intents_dict, slots_dict, max_round_num):
+        """
+        The constructor for StateEncoder.
+
+        Computes the offsets of the segments of the state representation, in the order they are fed to the agent:
+        user intent, user informs, user requests, agent intent, agent informs, agent requests, current slots, turn,
+        turn one-hot, KB binary counts and KB scaled counts.
+
+        Parameters:
+            intents_dict (dict): The index of each intent
+            slots_dict (dict): The index of each slot
+            max_round_num (int): The maximum number of rounds of a dialogue
+        """
+
+        self.intents_dict = intents_dict
+        self.slots_dict = slots_dict
+        num_intents = len(intents_dict)
+        num_slots = len(slots_dict)
+
+        segment_sizes = [('user_act', num_intents), ('user_inform_slots', num_slots),
+                         ('user_request_slots', num_slots), ('agent_act', num_intents),
+                         ('agent_inform_slots', num_slots), ('agent_request_slots', num_slots),
+                         ('current_slots', num_slots), ('turn', 1), ('turn_onehot', max_round_num),
+                         ('kb_binary', num_slots + 1), ('kb_count', num_slots + 1)]
+
+        self.offsets = {}
+        offset = 0
+        for name, size in segment_sizes:
+            self.offsets[name] = offset
+            offset += size
+        self.state_size = offset
+
+        # The turn and KB scaled counts are the only positions that are not binary, kept dense in the sparse states
+        self.dense_positions = np.array([self.offsets['turn']] + list(range(self.offsets['kb_count'], offset)))
+        self.binary_mask = np.ones(self.state_size, dtype=np.bool_)
+        self.binary_mask[self.dense_positions] = False
+
+        self.buffer = np.zeros(self.state_size, dtype=np.float32)
+        # Views of the segments in the buffer
+        self.segments = {name: self.buffer[self.offsets[name]:self.offsets[name] + size]
+                         for name, size in segment_sizes}
+
+    def encode(self, history, current_informs, round_num, db_results_dict, view=False):
+        """
+        Encodes the state representation of a turn.
+
+        Only the nonzero positions are written, after the buffer of the previous turn is zeroed.
+
+        Parameters:
+            history (DialogueHistory): The history of the dialogue, the last action being the user one and the one
+                                       before it (if any) the agent one
+            current_informs (dict): The current informs
+            round_num (int): The current round number
+            db_results_dict (dict): The KB counts of the current informs, as returned by get_db_results_for_slots
+            view (bool): Returns the buffer itself instead of a copy, it is overwritten by the next call. Default: False
+
+        Returns:
+            numpy.array: A float32 numpy array of shape (state size,)
+        """
+
+        buffer = self.buffer
+        segments = self.segments
+        offsets = self.offsets
+        slots_dict = self.slots_dict
+        buffer.fill(0.)
+
+        # One-hot of intents and bags of inform and request slots to represent the current user action, if any
+        user_row = history.row(1)
+        if user_row is not None:
+            buffer[offsets['user_act'] + history.intents[user_row]] = 1.0
+            segments['user_inform_slots'][:] = history.inform_slots[user_row]
+            segments['user_request_slots'][:] = history.request_slots[user_row]
+
+        # Last agent intent, inform slots and request slots
+        agent_row = history.row(2)
+        if agent_row is not None:
+            buffer[offsets['agent_act'] + history.intents[agent_row]] = 1.0
+            segments['agent_inform_slots'][:] = history.inform_slots[agent_row]
+            segments['agent_request_slots'][:] = history.request_slots[agent_row]
+
+        # Bag of filled_in slots based on the current_slots
+        for key in current_informs:
+            buffer[offsets['current_slots'] + slots_dict[key]] = 1.0
+
+        # Value and one-hot representations of the round num
+        buffer[offsets['turn']] = round_num / 5.
+        segments['turn_onehot'][round_num - 1] = 1.0
+
+        # Representation of DB query results (binary and scaled counts), the last position is for all constraints
+        all_count = db_results_dict[const.KB_MATCHING_ALL_CONSTRAINTS]
+        segments['kb_binary'].fill(all_count > 0.)
+        segments['kb_count'].fill(all_count / 100.)
+        for key, count in db_results_dict.items():
+            if key in slots_dict:
+                buffer[offsets['kb_binary'] + slots_dict[key]] = count > 0.
+                buffer[offsets['kb_count'] + slots_dict[key]] = count / 100.
+
+        return buffer if view else buffer.copy()
+
+    def encode_sparse(self, history, current_informs, round_num, db_results_dict):
+        """
+        Encodes the state representation of a turn in its sparse form.
+
+        Parameters:
+            history (DialogueHistory): The history of the dialogue
+            current_informs (dict): The current informs
+            round_num (int): The current round number
+            db_results_dict (dict): The KB counts of the current informs, as returned by get_db_results_for_slots
+
+        Returns:
+            SparseState: The sparse state representation
+        """
+
+        buffer = self.encode(history, current_informs, round_num, db_results_dict, view=True)
+        return self.to_sparse(buffer)
+
+    def to_sparse(self, state):
+        """
+        Returns the sparse form of a dense state representation.
+
+        Parameters:
+            state (numpy.array): A numpy array of shape (state size,)
+
+        Returns:
+            SparseState: The sparse state representation
+        """
+
+        indices = np.flatnonzero(np.logical_and(state, self.binary_mask)).astype(np.int16)
+        return SparseState(indices, state[self.dense_positions].astype(np.float32, copy=False), self.dense_positions,
+                           self.state_size)
+
+
+class SparseState:
+    """
+    A state representation in sparse form: the indices of the binary positions set to 1, and the values of the few
+    positions that are not binary (the turn and the KB scaled counts).
+    """
+
+    __slots__ = ('indices', 'values', 'dense_positions', 'size')
+
+    def __init__(self, indices, values, dense_positions, size):
+        """
+        The constructor for SparseState.
+
+        Parameters:
+            indices (numpy.array): The positions set to 1.0
+            values (numpy.array): The values of the dense positions
+            dense_positions (numpy.array): The positions that are not binary, shared by all states of an encoder
+            size (int): The state size of the dense state representation
+        """
+
+        self.indices = indices
+        self.values = values
+        self.dense_positions = dense_positions
+        self.size = size
+
+    def to_dense(self, out=None):
+        """
+        Returns the dense state representation.
+
+        Parameters:
+            out (numpy.array): The array of shape (state size,) to write it in, None for a new one. Default: None
+
+        Returns:
+            numpy.array: A numpy array of shape (state size,), float32 if new
+        """
+
+        if out is None:
+            state = np.zeros(self.size, dtype=np.float32)
+        else:
+            state = out
+            state.fill(0.)
+        state[self.indices] = 1.0
+        state[self.dense_positions] = self.values
+        return state
+
+
+def stack_states(states):
+    """
+    Stacks state representations, dense or sparse, in a matrix to be fed into the agent's neural network.
+
+    The sparse states are scattered all at once into the matrix, without building their dense form one by one.
+
+    Parameters:
+        states (list): The numpy arrays of shape (state size,) or the SparseStates
+
+    Returns:
+        numpy.array: A numpy array of shape (number of states, state size)
+    """
+
+    if not isinstance(states[0], SparseState):
+        return np.array(states)
+
+    matrix = np.zeros((len(states), states[0].size), dtype=np.float32)
+    rows = np.repeat(np.arange(len(states)), [len(state.indices) for state in states])
+    matrix[rows, np.concatenate([state.indices for state in states])] = 1.0
+    matrix[:, states[0].dense_positions] = np.stack([state.values for state in states])
+    return matrix
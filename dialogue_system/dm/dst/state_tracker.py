@@ -1,16 +1,108 @@
 from dialogue_system.dm.dst.db_query import DBQuery
-from utils.util import convert_list_to_dict, remove_empty_slots, log
+from dialogue_system.dm.dst.sqlite_db_query import SQLiteDBQuery
+from dialogue_system.dm.dst.knowledge_base import get_knowledge_base, database_fingerprint
+from dialogue_system.dm.dst.state_encoder import StateEncoder
+from dialogue_system.dm.dst.dialogue_history import DialogueHistory
+from utils.util import convert_list_to_dict, log, is_logging_enabled
 import dialogue_system.dialogue_config as cfg
 import dialogue_system.constants as const
 import numpy as np
 import copy
-import pickle
+
+
+def create_db_helper(config):
+    """
+    Creates the DB query object of the state tracker, as set in the dst config.
+
+    The query caches are warmed with the ones saved by a previous run on the same KB, if a persistent cache is
+    configured.
+
+    Parameters:
+        config (dict): Loaded config in dict
+
+    Returns:
+        DBQuery: The DB query object
+    """
+
+    # Get the movie DB (pickled or compiled), shared with the other components, or the SQLite file built from it
+    database_path = config['db_file_paths']['database']
+    db_query_name = config['dst']['db_query']
+    if db_query_name == 'DBQuery':
+        db_helper = DBQuery(get_knowledge_base(database_path), config['dst']['cache_size'])
+    elif db_query_name == 'SQLiteDBQuery':
+        db_helper = SQLiteDBQuery(config['dst']['sqlite_path'], database_path, config['dst']['cache_size'])
+    else:
+        raise Exception(f"No such db query: {db_query_name}")
+
+    persistent_cache_path = config['dst']['persistent_cache_path']
+    if persistent_cache_path:
+        if db_helper.load_cache(persistent_cache_path, database_fingerprint(database_path)):
+            log(['runner'], f'Loaded DB query cache from {persistent_cache_path}')
+    return db_helper
+
+
+def add_inform(db_helper, current_informs, key, value):
+    """
+    Adds an inform to the current informs of a dialogue.
+
+    The value is normalized and interned once by the DB helper, so the KB queries only compare integer codes. The
+    current informs keep its surface form.
+
+    Parameters:
+        db_helper (DBQuery): The DB query object
+        current_informs (dict): The current informs of the dialogue
+        key (str): The slot of the inform
+        value (str): The value of the inform
+    """
+
+    db_helper.intern_value(key, value)
+    current_informs[key] = value
+
+
+def augment_agent_action(db_helper, agent_action, current_informs, round_num):
+    """
+    Augments an agent's action with query information, and its round and speaker.
+
+    The informs filled in by the DB helper (and the match of a match found) are added to the current informs.
+
+    Parameters:
+        db_helper (DBQuery): The DB query object
+        agent_action (dict): The agent action of format dict('intent': '', 'inform_slots': {}, 'request_slots': {})
+                             and changed to dict('intent': '', 'inform_slots': {}, 'request_slots': {},
+                             'round': int, 'speaker': 'Agent')
+        current_informs (dict): The current informs of the dialogue
+        round_num (int): The current round of the dialogue
+    """
+
+    match_key = cfg.usersim_default_key
+    if agent_action[const.INTENT] == const.INFORM:
+        assert agent_action[const.INFORM_SLOTS]
+        inform_slots = db_helper.fill_inform_slot(agent_action[const.INFORM_SLOTS], current_informs)
+        agent_action[const.INFORM_SLOTS] = inform_slots
+        assert agent_action[const.INFORM_SLOTS]
+        for key, value in list(agent_action[const.INFORM_SLOTS].items()):
+            assert key != const.MATCH_FOUND
+            assert value != const.PLACEHOLDER, 'KEY: {}'.format(key)
+            add_inform(db_helper, current_informs, key, value)
+    # If intent is match_found then fill the action informs with the matches informs (if there is a match)
+    elif agent_action[const.INTENT] == const.MATCH_FOUND:
+        assert not agent_action[const.INFORM_SLOTS], 'Cannot inform and have intent of match found!'
+        db_results = db_helper.get_db_results(current_informs)
+        if db_results:
+            # Arbitrarily pick the first value of the dict
+            key, value = list(db_results.items())[0]
+            agent_action[const.INFORM_SLOTS] = copy.deepcopy(value)
+            agent_action[const.INFORM_SLOTS][match_key] = str(key)
+        else:
+            agent_action[const.INFORM_SLOTS][match_key] = const.NO_MATCH
+        current_informs[match_key] = agent_action[const.INFORM_SLOTS][match_key]
+    agent_action.update({const.ROUND: round_num, const.SPEAKER_TYPE: const.AGT_SPEAKER_VAL})
 
 
 class StateTracker:
     """Tracks the state of the episode/conversation and prepares the state representation for the agent."""
 
-    def __init__(self, config):
+    def __init__(self, config, db_helper=None):
         """
         The constructor of StateTracker.
 
@@ -19,25 +111,29 @@ class StateTracker:
 
         Parameters:
             config (dict): Loaded config in dict
+            db_helper (DBQuery): A DB query object shared with other state trackers, None to create one. Default: None
 
         """
 
-        # Load movie DB
-        # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
-        database_path = config['db_file_paths']['database']
-        database = pickle.load(open(database_path, 'rb'), encoding='latin1')
-
-        # Clean DB
-        remove_empty_slots(database)
-
-        self.db_helper = DBQuery(database)
+        if db_helper is None:
+            db_helper = create_db_helper(config)
+        self.db_helper = db_helper
+        self.database_path = config['db_file_paths']['database']
+        self.persistent_cache_path = config['dst']['persistent_cache_path']
         self.match_key = cfg.usersim_default_key
         self.intents_dict = convert_list_to_dict(cfg.all_intents)
         self.num_intents = len(cfg.all_intents)
         self.slots_dict = convert_list_to_dict(cfg.all_slots)
         self.num_slots = len(cfg.all_slots)
         self.max_round_num = config['run']['max_round_num']
-        self.none_state = np.zeros(self.get_state_size())
+        self.state_encoder = StateEncoder(self.intents_dict, self.slots_dict, self.max_round_num)
+        # The history keeps the last actions encoded, and the full actions only if a trace consumer needs them
+        self.history = DialogueHistory(self.intents_dict, self.slots_dict, config['dst']['history_size'],
+                                       config['dst']['keep_history'])
+        self.sparse_state = config['dst']['sparse_state']
+        self.none_state = np.zeros(self.get_state_size(), dtype=np.float32)
+        if self.sparse_state:
+            self.none_state = self.state_encoder.to_sparse(self.none_state)
         self.reset()
 
     def get_state_size(self):
@@ -46,17 +142,28 @@ class StateTracker:
         return 2 * self.num_intents + 7 * self.num_slots + 3 + self.max_round_num
 
     def reset(self):
-        """Resets current_informs, history and round_num."""
+        """Resets current_informs, history, round_num and the last query of the DB helper."""
 
         self.current_informs = {}
-        # A list of the dialogues (dicts) by the agent and user so far in the conversation
-        self.history = []
+        # The actions by the agent and user so far in the conversation
+        self.history.reset()
         self.round_num = 0
+        self.db_helper.reset()
+
+    def save_cache(self):
+        """Saves the query caches of the DB helper, if a persistent cache is configured."""
+
+        if self.persistent_cache_path:
+            self.db_helper.save_cache(self.persistent_cache_path, database_fingerprint(self.database_path))
+            log(['runner'], f'Saved DB query cache in {self.persistent_cache_path}')
 
     def print_history(self):
         """Helper function if you want to see the current history action by action."""
 
-        for action in self.history:
+        if self.history.actions is None:
+            print('The full actions are not kept, set keep_history in the dst config')
+            return
+        for action in self.history.actions:
             print(action)
 
     def get_suggest_slots_values(self, request_slots):
@@ -73,7 +180,7 @@ class StateTracker:
         kb_results = self.db_helper.get_db_results(self.current_informs)
         return kb_results
 
-    def get_state(self, done=False):
+    def get_state(self, done=False, view=False):
         """
         Returns the state representation as a numpy array which is fed into the agent's neural network.
 
@@ -82,9 +189,12 @@ class StateTracker:
 
         Parameters:
             done (bool): Indicates whether this is the last dialogue in the episode/conversation. Default: False
+            view (bool): Returns the buffer of the state encoder instead of a copy, it is overwritten by the next call.
+                         Default: False
 
         Returns:
-            numpy.array: A numpy array of shape (state size,)
+            numpy.array: A float32 numpy array of shape (state size,), or a SparseState if the sparse state is set in
+                         the dst config (view is then ignored)
 
         """
 
@@ -92,79 +202,21 @@ class StateTracker:
         if done:
             return self.none_state
 
-        user_action = self.history[-1]
         db_results_dict = self.db_helper.get_db_results_for_slots(self.current_informs)
-        db_results = self.db_helper.get_db_results(self.current_informs)
-        list_results = []
-        for idx in list(db_results):
-            list_results.append(db_results[idx])
-        log(['dialogue'], f"DB results: {list_results}")
-        log(['dialogue'], f"DB count: {db_results_dict}")
-        log(['dialogue'], f"Current informs: {self.current_informs}")
-        last_agent_action = self.history[-2] if len(self.history) > 1 else None
-
-        # Create one-hot of intents to represent the current user action
-        user_act_rep = np.zeros((self.num_intents,))
-        user_act_rep[self.intents_dict[user_action[const.INTENT]]] = 1.0
-
-        # Create bag of inform slots representation to represent the current user action
-        user_inform_slots_rep = np.zeros((self.num_slots,))
-        for key in user_action[const.INFORM_SLOTS].keys():
-            user_inform_slots_rep[self.slots_dict[key]] = 1.0
-
-        # Create bag of request slots representation to represent the current user action
-        user_request_slots_rep = np.zeros((self.num_slots,))
-        for key in user_action[const.REQUEST_SLOTS].keys():
-            user_request_slots_rep[self.slots_dict[key]] = 1.0
-
-        # Create bag of filled_in slots based on the current_slots
-        current_slots_rep = np.zeros((self.num_slots,))
-        for key in self.current_informs:
-            current_slots_rep[self.slots_dict[key]] = 1.0
-
-        # Encode last agent intent
-        agent_act_rep = np.zeros((self.num_intents,))
-        if last_agent_action:
-            agent_act_rep[self.intents_dict[last_agent_action[const.INTENT]]] = 1.0
-
-        # Encode last agent inform slots
-        agent_inform_slots_rep = np.zeros((self.num_slots,))
-        if last_agent_action:
-            for key in last_agent_action[const.INFORM_SLOTS].keys():
-                agent_inform_slots_rep[self.slots_dict[key]] = 1.0
-
-        # Encode last agent request slots
-        agent_request_slots_rep = np.zeros((self.num_slots,))
-        if last_agent_action:
-            for key in last_agent_action[const.REQUEST_SLOTS].keys():
-                agent_request_slots_rep[self.slots_dict[key]] = 1.0
-
-        # Value representation of the round num
-        turn_rep = np.zeros((1,)) + self.round_num / 5.
-
-        # One-hot representation of the round num
-        turn_onehot_rep = np.zeros((self.max_round_num,))
-        turn_onehot_rep[self.round_num - 1] = 1.0
-
-        # Representation of DB query results (scaled counts)
-        kb_count_rep = np.zeros((self.num_slots + 1,)) + db_results_dict[const.KB_MATCHING_ALL_CONSTRAINTS] / 100.
-        for key in db_results_dict.keys():
-            if key in self.slots_dict:
-                kb_count_rep[self.slots_dict[key]] = db_results_dict[key] / 100.
-
-        # Representation of DB query results (binary)
-        kb_binary_rep = np.zeros((self.num_slots + 1,)) + \
-            np.sum(db_results_dict[const.KB_MATCHING_ALL_CONSTRAINTS] > 0.)
-        for key in db_results_dict.keys():
-            if key in self.slots_dict:
-                kb_binary_rep[self.slots_dict[key]] = np.sum(db_results_dict[key] > 0.)
-
-        state_representation = np.hstack(
-            [user_act_rep, user_inform_slots_rep, user_request_slots_rep, agent_act_rep, agent_inform_slots_rep,
-             agent_request_slots_rep, current_slots_rep, turn_rep, turn_onehot_rep, kb_binary_rep,
-             kb_count_rep]).flatten()
-
-        return state_representation
+        # The DB results are only queried and formatted if someone reads the dialogue log
+        if is_logging_enabled(['dialogue']):
+            db_results = self.db_helper.get_db_results(self.current_informs)
+            list_results = []
+            for idx in list(db_results):
+                list_results.append(db_results[idx])
+            log(['dialogue'], f"DB results: {list_results}")
+            log(['dialogue'], f"DB count: {db_results_dict}")
+            log(['dialogue'], f"Current informs: {self.current_informs}")
+
+        if self.sparse_state:
+            return self.state_encoder.encode_sparse(self.history, self.current_informs, self.round_num,
+                                                    db_results_dict)
+        return self.state_encoder.encode(self.history, self.current_informs, self.round_num, db_results_dict, view)
 
     def update_state_agent(self, agent_action):
         """
@@ -179,28 +231,7 @@ class StateTracker:
                                  'request_slots': {}, 'round': int, 'speaker': 'Agent')
         """
 
-        if agent_action[const.INTENT] == const.INFORM:
-            assert agent_action[const.INFORM_SLOTS]
-            inform_slots = self.db_helper.fill_inform_slot(agent_action[const.INFORM_SLOTS], self.current_informs)
-            agent_action[const.INFORM_SLOTS] = inform_slots
-            assert agent_action[const.INFORM_SLOTS]
-            for key, value in list(agent_action[const.INFORM_SLOTS].items()):
-                assert key != const.MATCH_FOUND
-                assert value != const.PLACEHOLDER, 'KEY: {}'.format(key)
-                self.current_informs[key] = value
-        # If intent is match_found then fill the action informs with the matches informs (if there is a match)
-        elif agent_action[const.INTENT] == const.MATCH_FOUND:
-            assert not agent_action[const.INFORM_SLOTS], 'Cannot inform and have intent of match found!'
-            db_results = self.db_helper.get_db_results(self.current_informs)
-            if db_results:
-                # Arbitrarily pick the first value of the dict
-                key, value = list(db_results.items())[0]
-                agent_action[const.INFORM_SLOTS] = copy.deepcopy(value)
-                agent_action[const.INFORM_SLOTS][self.match_key] = str(key)
-            else:
-                agent_action[const.INFORM_SLOTS][self.match_key] = const.NO_MATCH
-            self.current_informs[self.match_key] = agent_action[const.INFORM_SLOTS][self.match_key]
-        agent_action.update({const.ROUND: self.round_num, const.SPEAKER_TYPE: const.AGT_SPEAKER_VAL})
+        augment_agent_action(self.db_helper, agent_action, self.current_informs, self.round_num)
         self.history.append(agent_action)
 
     def update_state_user(self, user_action):
@@ -217,7 +248,7 @@ class StateTracker:
         """
 
         for key, value in user_action[const.INFORM_SLOTS].items():
-            self.current_informs[key] = value
+            add_inform(self.db_helper, self.current_informs, key, value)
         user_action.update({const.ROUND: self.round_num + 1, const.SPEAKER_TYPE: const.USR_SPEAKER_VAL})
         self.history.append(user_action)
         self.round_num += 1
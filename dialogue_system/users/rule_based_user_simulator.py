@@ -7,7 +7,8 @@ import math
 import dialogue_system.nlu as nlus
 import dialogue_system.nlg as nlgs
 
-from utils.util import remove_empty_slots, log
+from dialogue_system.dm.dst.knowledge_base import get_knowledge_base
+from utils.util import log
 
 
 class RuleBasedUserSimulator:
@@ -26,13 +27,9 @@ class RuleBasedUserSimulator:
         goals_path = config['db_file_paths']['user_goals']
         self.goal_list = pickle.load(open(goals_path, 'rb'), encoding='latin1')
 
-        # Load movie DB
-        # Note: If you get an unpickling error here then run 'pickle_converter.py' and it should fix it
+        # Get the movie DB (pickled or compiled), shared with the state tracker
         database_path = config['db_file_paths']['database']
-        self.database = pickle.load(open(database_path, 'rb'), encoding='latin1')
-
-        # Clean DB
-        remove_empty_slots(self.database)
+        self.database = get_knowledge_base(database_path).database
 
         # Compute the split point of the goal list
         split = math.ceil(config['run']['split_ratio'] * len(self.goal_list))
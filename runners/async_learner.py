@@ -0,0 +1,78 @@
+import threading
+import time
+
+import keras.backend as K
+
+
+class AsyncLearner:
+    """
+    Trains the agent in a background thread while the dialogues keep being collected.
+
+    The learner trains the behavior model on one batch of the memory after the other and publishes its weights to the
+    NumPy inference of the agent, which the dialogues act with, every publish_freq batches. In between, the dialogues
+    use slightly stale weights. The model lock pauses the learner between two batches, for the operations of the
+    trainer on the models (copy, save or flush).
+    """
+
+    def __init__(self, agent, publish_freq):
+        """
+        The constructor for AsyncLearner.
+
+        Parameters:
+            agent (DQNAgent): The agent, with a NumPy inference
+            publish_freq (int): The number of trained batches between two publications of the weights
+        """
+
+        if agent.beh_inference is None:
+            raise ValueError('The asynchronous learner needs the numpy inference of the agent model')
+
+        self.agent = agent
+        self.publish_freq = publish_freq
+        self.num_publications = 0
+        self.error = None
+
+        self.model_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name='learner', daemon=True)
+
+        # The TensorFlow graph is per thread, the learner uses the one of the models
+        self.session = K.get_session()
+        self.graph = self.session.graph
+
+    def start(self):
+        """Starts the learner thread."""
+
+        self.thread.start()
+
+    def stop(self):
+        """Stops the learner thread after its current batch, publishing the last weights."""
+
+        self.stop_event.set()
+        self.thread.join()
+        self.agent.refresh_inference()
+        self.check()
+
+    def check(self):
+        """Raises the error that stopped the learner thread, if any."""
+
+        if self.error is not None:
+            raise self.error
+
+    def __run(self):
+        try:
+            with self.graph.as_default(), self.session.as_default():
+                batches_since_publication = 0
+                while not self.stop_event.is_set():
+                    with self.model_lock:
+                        trained = self.agent.train_batch()
+                        if trained:
+                            batches_since_publication += 1
+                            if batches_since_publication == self.publish_freq:
+                                self.agent.refresh_inference()
+                                self.num_publications += 1
+                                batches_since_publication = 0
+                    if not trained:
+                        # Not enough experiences in the memory yet (e.g. after a flush)
+                        time.sleep(0.01)
+        except Exception as e:
+            self.error = e
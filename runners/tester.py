@@ -63,3 +63,5 @@ class Tester:
         log(['runner'], '...Testing Ended')
 
         save_json_file(self.performance_path, self.performance_metrics, mode="a")
+
+        self.dialogue_system.state_tracker.save_cache()
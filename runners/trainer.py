@@ -4,10 +4,13 @@ import logging
 import json
 import re
 import copy
+import time
+import contextlib
 
 from dialogue_system import DialogueSystem
 from utils.util import save_json_file, log
 from .tester import Tester
+from .async_learner import AsyncLearner
 
 class Trainer:
 
@@ -29,6 +32,10 @@ class Trainer:
         self.num_ep_run = run_dict['num_ep_run']
         self.train_freq = run_dict['train_freq']
 
+        # Asynchronous learner, training in the background while the dialogues go on
+        self.async_learner = run_dict['async_learner']['enabled']
+        self.publish_freq = run_dict['async_learner']['publish_freq']
+
         self.max_round_num = run_dict['max_round_num']
         self.success_rate_threshold = run_dict['success_rate_threshold']
 
@@ -91,15 +98,45 @@ class Trainer:
 
         Trains the agent on the goal-oriented chatbot task. Training of the agent's neural network occurs
         every episode that TRAIN_FREQ is a multiple of. Terminates when the episode reaches NUM_EP_TRAIN.
+
+        With the asynchronous learner, the agent's neural network is trained continuously in a background thread
+        instead, and every TRAIN_FREQ episodes the learner is only paused for the copy to the target model.
         """
 
         log(['runner'], 'Training Started...')
 
+        learner = None
+        if self.async_learner:
+            learner = AsyncLearner(self.dialogue_system.agent, self.publish_freq)
+            learner.start()
+        try:
+            self.__run_train_episodes(learner)
+        finally:
+            if learner is not None:
+                learner.stop()
+
+        log(['runner'], '...Training Ended')
+
+        save_json_file(self.performance_path, self.performance_metrics)
+
+    def __run_train_episodes(self, learner):
+        """
+        Runs the training episodes, see __run_train.
+
+        Parameters:
+            learner (AsyncLearner): The asynchronous learner, None to train every TRAIN_FREQ episodes
+        """
+
         episode = 0
         period_metrics = {'reward': 0, 'success': 0, 'round': 0}
         best_success_rate = 0.0
         self.steps = 0
 
+        # For the step and update rates
+        period_start = time.perf_counter()
+        period_start_steps = 0
+        period_start_batches = self.dialogue_system.agent.trained_batches
+
         while episode < self.num_ep_run:
             self.dialogue_system.reset(episode)
             done = False
@@ -120,6 +157,8 @@ class Trainer:
 
             # Train
             if episode % self.train_freq == 0:
+                if learner is not None:
+                    learner.check()
 
                 # evaluate metrics
                 self.performance_metrics['train']['success_rate'][episode] = period_metrics['success'] / self.train_freq
@@ -130,25 +169,44 @@ class Trainer:
                 success_rate = period_metrics['success'] / self.train_freq
                 avg_reward = period_metrics['reward'] / self.train_freq
 
-                # Flush
-                if success_rate >= best_success_rate and success_rate >= self.success_rate_threshold:
-                    self.dialogue_system.agent.empty_memory()
+                # The learner is paused while the models and the memory are changed here
+                with learner.model_lock if learner is not None else contextlib.nullcontext():
+                    # Flush
+                    if success_rate >= best_success_rate and success_rate >= self.success_rate_threshold:
+                        self.dialogue_system.agent.empty_memory()
 
-                # Update current best success rate
-                if success_rate >= best_success_rate:
-                    log(['runner'], f'Episode: {episode} NEW BEST SUCCESS RATE: {success_rate} Avg Reward: {avg_reward}')
-                    best_success_rate = success_rate
-                    self.dialogue_system.agent.save_weights()
+                    # Update current best success rate
+                    if success_rate >= best_success_rate:
+                        log(['runner'], f'Episode: {episode} NEW BEST SUCCESS RATE: {success_rate} '
+                                        f'Avg Reward: {avg_reward}')
+                        best_success_rate = success_rate
+                        self.dialogue_system.agent.save_weights()
+
+                    # Copy
+                    self.dialogue_system.agent.copy()
 
                 period_metrics['success'] = 0
                 period_metrics['reward'] = 0
                 period_metrics['round'] = 0
 
-                # Copy
-                self.dialogue_system.agent.copy()
-
                 # Train
-                self.dialogue_system.agent.train()
+                if learner is None:
+                    self.dialogue_system.agent.train()
+
+                # Log the rates of the dialogue steps and of the trained batches over the period
+                trained_batches = self.dialogue_system.agent.trained_batches
+                elapsed = time.perf_counter() - period_start
+                step_rate = (self.steps - period_start_steps) / elapsed
+                update_rate = (trained_batches - period_start_batches) / elapsed
+                log(['runner'], f'Episode: {episode} Step rate: {step_rate:.1f} steps/s '
+                                f'Update rate: {update_rate:.1f} batches/s')
+                period_start = time.perf_counter()
+                period_start_steps = self.steps
+                period_start_batches = trained_batches
+
+                # Log the query cache usage, to help sizing it
+                cache_stats = self.dialogue_system.state_tracker.db_helper.cache_stats()
+                log(['runner'], f'Episode: {episode} DB cache stats: {cache_stats}')
 
                 # Save partial metrics
                 save_json_file(self.performance_path, self.performance_metrics)
@@ -158,10 +216,6 @@ class Trainer:
 
             episode += 1
 
-        log(['runner'], '...Training Ended')
-
-        save_json_file(self.performance_path, self.performance_metrics)
-
     def __update_sigma(self, episode):
         # use sigma for partial switch to agent
         a = -float(self.sigma_init - self.sigma_stop) / self.sigma_decay
@@ -170,5 +224,9 @@ class Trainer:
         return sigma
 
     def run(self):
-        self.__run_warmup()
-        self.__run_train()
+        try:
+            self.__run_warmup()
+            self.__run_train()
+        finally:
+            # Keep the query caches for the next runs, even if the training is interrupted
+            self.dialogue_system.state_tracker.save_cache()
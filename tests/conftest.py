@@ -0,0 +1,22 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The modules are imported from the repository root, where the loggers write and the data paths are relative to
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+os.makedirs('logs', exist_ok=True)
+
+
+@pytest.fixture
+def config():
+    """The training config, with no weights saved or loaded."""
+
+    with open(os.path.join('config', 'config_softmax.json')) as f:
+        config = json.load(f)
+    config['agent']['save_weights_file_path'] = ''
+    config['agent']['load_weights_file_path'] = ''
+    return config
@@ -0,0 +1,41 @@
+import copy
+
+import numpy as np
+
+import dialogue_system.constants as const
+from dialogue_system.dm.dst.batch_state_tracker import BatchStateTracker
+from dialogue_system.dm.dst.state_tracker import StateTracker
+
+
+USER_ACTION = {const.INTENT: 'request', const.INFORM_SLOTS: {'moviename': 'zootopia', 'city': 'seattle'},
+               const.REQUEST_SLOTS: {'starttime': const.UNKNOWN}}
+AGENT_ACTION = {const.INTENT: 'inform', const.INFORM_SLOTS: {'theater': 'PLACEHOLDER'}, const.REQUEST_SLOTS: {}}
+
+
+def test_reset_dialogues_match_state_tracker(config):
+    state_tracker = StateTracker(config)
+    batch_state_tracker = BatchStateTracker(config, 3)
+
+    states = batch_state_tracker.get_state()
+    for row in states:
+        np.testing.assert_array_equal(row, state_tracker.get_state())
+
+
+def test_updated_and_reset_dialogues_match_state_tracker(config):
+    state_tracker = StateTracker(config)
+    reset_state = state_tracker.get_state()
+    batch_state_tracker = BatchStateTracker(config, 3)
+
+    # Dialogue 1 gets a user and an agent action, then a user action
+    for update in ('update_state_user', 'update_state_agent', 'update_state_user'):
+        action = USER_ACTION if update == 'update_state_user' else AGENT_ACTION
+        getattr(state_tracker, update)(copy.deepcopy(action))
+        getattr(batch_state_tracker, update)(1, copy.deepcopy(action))
+
+        states = batch_state_tracker.get_state()
+        np.testing.assert_array_equal(states[0], reset_state)
+        np.testing.assert_array_equal(states[1], state_tracker.get_state())
+        np.testing.assert_array_equal(states[2], reset_state)
+
+    batch_state_tracker.reset(1)
+    np.testing.assert_array_equal(batch_state_tracker.get_state()[1], reset_state)
@@ -0,0 +1,46 @@
+import pytest
+
+import dialogue_system.constants as const
+from dialogue_system.dm.dst.state_tracker import StateTracker
+from utils.util import is_logging_enabled, set_logging_enabled
+
+
+@pytest.fixture
+def dialogue_logging():
+    """Turns the dialogue logger on or off in a test, and back on after it."""
+
+    yield lambda enabled: set_logging_enabled('dialogue', enabled)
+    set_logging_enabled('dialogue', True)
+
+
+def count_db_results_calls(state_tracker):
+    """Wraps get_db_results of the DB helper of a state tracker, returning the list of its calls."""
+
+    calls = []
+    get_db_results = state_tracker.db_helper.get_db_results
+
+    def counting_get_db_results(current_informs):
+        calls.append(dict(current_informs))
+        return get_db_results(current_informs)
+
+    state_tracker.db_helper.get_db_results = counting_get_db_results
+    return calls
+
+
+def user_action():
+    return {const.INTENT: 'request', const.INFORM_SLOTS: {'moviename': 'zootopia'},
+            const.REQUEST_SLOTS: {'starttime': const.UNKNOWN}}
+
+
+@pytest.mark.parametrize('enabled', [True, False])
+def test_get_state_builds_the_dialogue_log_only_if_enabled(config, dialogue_logging, enabled):
+    dialogue_logging(enabled)
+    assert is_logging_enabled(['dialogue']) == enabled
+
+    state_tracker = StateTracker(config)
+    calls = count_db_results_calls(state_tracker)
+    state_tracker.update_state_user(user_action())
+    state_tracker.get_state()
+
+    assert len(calls) == (1 if enabled else 0)
+
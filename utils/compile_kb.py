@@ -0,0 +1,29 @@
+"""
+Compiles a pickled database (e.g. data/movie_db.p) into the columnar knowledge base format, or into a SQLite file.
+
+Run from the repository root:
+    python -m utils.compile_kb --database data/movie_db.p --output data/movie_db.kb
+    python -m utils.compile_kb --database data/movie_db.p --output data/movie_db.sqlite --format sqlite
+
+Then point 'db_file_paths.database' of the config to the compiled directory, or 'dst.sqlite_path' to the SQLite file
+(with 'dst.db_query' set to 'SQLiteDBQuery').
+"""
+
+import argparse
+from dialogue_system.dm.dst.knowledge_base import load_database, compile_database
+from dialogue_system.dm.dst.sqlite_db_query import build_sqlite_database
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', dest='database', type=str, default='data/movie_db.p')
+    parser.add_argument('--output', dest='output', type=str, default='data/movie_db.kb')
+    parser.add_argument('--format', dest='format', type=str, default='columnar', choices=['columnar', 'sqlite'])
+    args = parser.parse_args()
+
+    database = load_database(args.database)
+    if args.format == 'sqlite':
+        build_sqlite_database(database, args.output)
+    else:
+        compile_database(database, args.output)
+    print(f'Compiled {len(database)} items from {args.database} into {args.output}')
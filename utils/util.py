@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 import numpy as np
 from setup_logger import loggers
@@ -49,6 +50,31 @@ def log(names, msg):
     for name in names:
         loggers[name].info(msg)
 
+def is_logging_enabled(names):
+    """
+    Returns true if any of the loggers would write a message logged with log, to build costly messages only then.
+
+    Parameters:
+        names (list): The names of the loggers
+
+    Returns:
+        bool
+    """
+
+    # Logger.isEnabledFor ignores the disabled flag that set_logging_enabled sets
+    return any(not loggers[name].disabled and loggers[name].isEnabledFor(logging.INFO) for name in names)
+
+def set_logging_enabled(name, enabled):
+    """
+    Turns a logger on or off.
+
+    Parameters:
+        name (str): The name of the logger
+        enabled (bool)
+    """
+
+    loggers[name].disabled = not enabled
+
 def createVocabulary(input_path, output_path, no_pad=False):
     if not isinstance(input_path, str):
         raise TypeError('input_path should be string')